@@ -1,158 +1,210 @@
-import pygame.midi
-import time
+import array
+import bisect
+import functools
+import logging
 import threading
+import time
+from acceleration import KnobMotion
+from gestures import GestureRecognizer,SOURCES_PER_CHANNEL
+from midibackend import PygameBackend
+from scheduler import Scheduler
+from midiinput import MidiReader
+from meters import MeterBank
+from metrics import Metrics
+from surface import SurfaceState
 
-FAST_TIMER_PERIOD=0.01
 SLOW_TIMER_PERIOD=0.1
+DEVICE_NAMES=("X-Touch-Ext",)
+RECONNECT_PERIOD=0.5        #Seconds before the first attempt to reopen a unit that has gone away
+RECONNECT_MAX_PERIOD=8.0    #The wait doubles after every failed attempt up to this, since each rescan briefly closes the healthy units too
+FADER_ECHO_WINDOW=0.5       #Seconds after a motor move during which untouched level reports are the motor, not a hand
+FADER_ECHO_TOLERANCE=128    #Raw counts around the motor's target that still count as the motor settling once the window is over
+FADER_RELEASE_GUARD=0.25    #Seconds after release during which Eos is only echoing back levels the hand already sent
+FADER_DEADBAND=8            #Remote levels this close to where the fader already is don't get a motor move
+FADER_UNKNOWN=-1            #faderPosition until the hand or the motor has moved it, so the first motor move always goes out
+FADER_IDLE=0                #Fader ownership states, as kept in ControlState.faderState
+FADER_TOUCHED=1
+FADER_RELEASED=2            #Guarding against Eos echoing back what the hand just sent
+FADER_MOTOR=3               #Moved by setFader
+FADER_STATE_NAMES=("idle","touched","released","motor")
+SUPPRESSED_TOUCHED=0        #Fader suppression counters, four per fader in ControlState.faderSuppressed
+SUPPRESSED_RELEASED=1
+SUPPRESSED_ECHO=2
+SUPPRESSED_UNCHANGED=3
+SUPPRESSED_NAMES=("touched","released","echo","unchanged")
+
+log=logging.getLogger("XTouch")
 
 class ExternalDeviceNotFound(IOError): pass
 
+def enableDebugLogging():     #debugMode used to print; now it turns on the XTouch logger, formatting only happens if a record is actually emitted
+    if not logging.getLogger().handlers: logging.basicConfig()
+    log.setLevel(logging.DEBUG)
+
+class XtouchEvent(object):     #Payload handed to bound handlers.  Each control reuses one instance, so copy out anything you want to keep.
+    __slots__=("obj","channel","number","fader","value","level","magnitude","velocity","speedRange")
+
+    def __init__(self,obj,**fields):
+        self.obj=obj
+        for key in fields: setattr(self,key,fields[key])
+
+    def __getitem__(self,key):  #Handlers written against the old retval dicts keep working
+        try: return getattr(self,key)
+        except AttributeError: raise KeyError(key)
+
+    def __contains__(self,key):
+        return hasattr(self,key)
+
+    def get(self,key,default=None):
+        return getattr(self,key,default)
+
+class ControlState(object):     #What the controls share, and their state in flat arrays indexed by channel, so each control is little more than its position
+    def __init__(self,channels,surfaces,gestures,boundHandlers,motion,meters,vTable=(20,1000),debugMode=False):
+        self.surfaces=surfaces          #One SurfaceState per unit, indexed by channel//8
+        self.gestures=gestures          #Press timing for every knob push and button, SOURCES_PER_CHANNEL per channel
+        self.boundHandlers=boundHandlers
+        self.motion=motion
+        self.meters=meters
+        self.vTable=sorted(vTable)      #Knob velocity thresholds between speed ranges, in detents/sec
+        self.debug=debugMode
+        self.knobValue=array.array("l",[0])*channels
+        self.meterLevel=array.array("l",[0])*channels
+        self.faderState=array.array("B",[FADER_IDLE])*channels
+        self.faderSince=array.array("d",[0.0])*channels
+        self.faderPosition=array.array("l",[FADER_UNKNOWN])*channels  #Raw 14-bit level, wherever the hand or the motor last put it
+        self.faderTarget=array.array("l",[0])*channels
+        self.faderSuppressed=array.array("l",[0])*(4*channels)        #4*fader+SUPPRESSED_...
+
+    def faderStats(self,faders=None):      #Suppression counts summed over faders, every fader by default
+        if faders is None: faders=range(len(self.faderState))
+        retval={}
+        for i in range(len(SUPPRESSED_NAMES)):
+            retval[SUPPRESSED_NAMES[i]]=sum([self.faderSuppressed[4*fader+i] for fader in faders])
+        return retval
+
 class XtouchControl(object):
-    def __init__(self,channel,midiIn,midiOut,debugMode=False):
+    __slots__=("controls","channel","local")
+
+    def __init__(self,controls,channel):
+        self.controls=controls
         self.channel=channel
-        self.midiIn=midiIn
-        self.midiOut=midiOut
-        self.debug=debugMode
+        self.local=channel%8        #Position on its own extender, which is what goes on the wire
         self.sayName()
 
+    @property
+    def debug(self):
+        return self.controls.debug
+
+    @property
+    def surface(self):
+        return self.controls.surfaces[self.channel//8]
+
     def sayName(self):
-        if self.debug: print(self.name)
+        if self.controls.debug: log.debug(self.name)
 
 class Knob(XtouchControl):
-    def __init__(self,channel,midiIn,midiOut,pressAndHoldDuration,doublePressDuration,boundHandlers,vTable=[20,1000],debugMode=False):
-        self.name="Knob %d"%channel
-        self.val=0
-        self.boundHandlers=boundHandlers
-        self.pressAndHoldDuration=pressAndHoldDuration
-        self.doublePressDuration=doublePressDuration
-        self.channel=channel
-        self.t=threading.Timer(self.pressAndHoldDuration,self.pressAndHoldHandler)
-        self.lastPress=0
-        self.lastRotationTime=time.time()
-        self.vTable=vTable
-        XtouchControl.__init__(self,channel,midiIn,midiOut,debugMode)
-
+    __slots__=("source","event","onPress","onRelease","onIncrement","onDecrement","onPressAndHold","onDoublePress","onTriplePress")
+
+    def __init__(self,controls,channel):
+        self.source=SOURCES_PER_CHANNEL*channel
+        self.event=XtouchEvent(self,channel=channel)
+        XtouchControl.__init__(self,controls,channel)
+        controls.gestures.targets[self.source]=self
+        self.resolveHandlers()
+
+    @property
+    def name(self):
+        return "Knob %d"%self.channel
+
+    @property
+    def val(self):
+        return self.controls.knobValue[self.channel]
+
+    def resolveHandlers(self):  #Look the bound handlers up once at bind time rather than on every event
+        handlers=self.controls.boundHandlers[self.channel]
+        self.onPress=handlers.get("KnobPress")
+        self.onRelease=handlers.get("KnobRelease")
+        self.onIncrement=handlers.get("KnobIncrement")
+        self.onDecrement=handlers.get("KnobDecrement")
+        self.onPressAndHold=handlers.get("KnobPressAndHold")
+        self.onDoublePress=handlers.get("KnobDoublePress")
+        self.onTriplePress=handlers.get("KnobTriplePress")
 
     def pressHandler(self):
-        if self.debug: print("Knob %d pressed"%self.channel)
-        self.t=threading.Timer(self.pressAndHoldDuration,self.pressAndHoldHandler)
-        self.t.start()
-        if "KnobPress" in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            self.boundHandlers[self.channel]["KnobPress"](retval)
+        if self.controls.debug: log.debug("Knob %d pressed",self.channel)
+        self.controls.gestures.press(self.source,self.onPressAndHold is not None)
+        if self.onPress is not None: self.onPress(self.event)
 
     def releaseHandler(self):
-        if self.debug: print("Knob %d released"%self.channel)
-        self.t.cancel()
-        if (time.time()-self.lastPress)<self.doublePressDuration:
-            self.lastPress=0    #prevent multiple calls to double-press handler if somebody's button-happy
-            self.doublePressHandler()
-        else:
-            self.lastPress=time.time()
-        if "KnobRelease" in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            self.boundHandlers[self.channel]["KnobRelease"](retval)
+        if self.controls.debug: log.debug("Knob %d released",self.channel)
+        taps=self.controls.gestures.release(self.source)
+        if taps==2: self.doublePressHandler()
+        elif taps==3: self.triplePressHandler()
+        if self.onRelease is not None: self.onRelease(self.event)
+
+    def rotation(self,magnitude,handler):
+        controls=self.controls
+        if controls.gestures.down[self.source]: controls.gestures.interrupt(self.source)     #Pushed and turned isn't a hold
+        velocity=controls.motion.update(self.channel,magnitude)     #Smoothed, so one quick flick doesn't read as a spin
+        if handler is not None:
+            event=self.event
+            event.value=controls.knobValue[self.channel]
+            event.magnitude=magnitude
+            event.velocity=velocity
+            event.speedRange=bisect.bisect_left(controls.vTable,velocity)+1
+            handler(event)
 
     def incrementHandler(self,magnitude):
-        self.val+=magnitude
-        if self.debug: print("Knob %d increment, new value %d"%(self.channel,self.val))
-        self.t.cancel()
-        deltaT=time.time()-self.lastRotationTime
-        if deltaT==0: deltaT=.001
-        self.lastRotationTime=time.time()
-        velocity=magnitude/deltaT
-        speedRange=1
-        for i in range(len(self.vTable)):
-            if velocity>self.vTable[i]: speedRange=i+2
-        if "KnobIncrement" in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            retval["value"]=self.val
-            retval["magnitude"]=magnitude
-            retval["velocity"]=velocity
-            retval["speedRange"]=speedRange
-            self.boundHandlers[self.channel]["KnobIncrement"](retval)
+        values=self.controls.knobValue
+        values[self.channel]+=magnitude
+        if self.controls.debug: log.debug("Knob %d increment, new value %d",self.channel,values[self.channel])
+        self.rotation(magnitude,self.onIncrement)
 
     def decrementHandler(self,magnitude):
-        self.val-=magnitude
-        if self.debug: print("Knob %d decrement, new value %d"%(self.channel,self.val))
-        self.t.cancel()
-        deltaT=time.time()-self.lastRotationTime
-        if deltaT==0: deltaT=.001
-        self.lastRotationTime=time.time()
-        velocity=magnitude/deltaT
-        speedRange=1
-        for i in range(len(self.vTable)):
-            if velocity>self.vTable[i]: speedRange=i+2
-        if "KnobDecrement" in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            retval["value"]=self.val
-            retval["magnitude"]=magnitude
-            retval["velocity"]=velocity
-            retval["speedRange"]=speedRange
-            self.boundHandlers[self.channel]["KnobDecrement"](retval)
+        values=self.controls.knobValue
+        values[self.channel]-=magnitude
+        if self.controls.debug: log.debug("Knob %d decrement, new value %d",self.channel,values[self.channel])
+        self.rotation(magnitude,self.onDecrement)
 
     def pressAndHoldHandler(self):
-        if self.debug: print("Knob %d press and hold"%self.channel)
-        if "KnobPressAndHold" in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            self.boundHandlers[self.channel]["KnobPressAndHold"](retval)
+        if self.controls.debug: log.debug("Knob %d press and hold",self.channel)
+        if self.onPressAndHold is not None: self.onPressAndHold(self.event)
 
     def doublePressHandler(self):
-        if self.debug: print("Knob %d double press"%self.channel)
-        if "KnobDoublePress" in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            self.boundHandlers[self.channel]["KnobDoublePress"](retval)
+        if self.controls.debug: log.debug("Knob %d double press",self.channel)
+        if self.onDoublePress is not None: self.onDoublePress(self.event)
+
+    def triplePressHandler(self):
+        if self.controls.debug: log.debug("Knob %d triple press",self.channel)
+        if self.onTriplePress is not None: self.onTriplePress(self.event)
 
 class KnobRing(XtouchControl):
-    def __init__(self,channel,midiIn,midiOut,debugMode=False):
-        self.channel=channel
-        self.name="Knob Ring %d"%channel
-        XtouchControl.__init__(self,channel,midiIn,midiOut,debugMode)
+    __slots__=()
+
+    @property
+    def name(self):
+        return "Knob Ring %d"%self.channel
 
     def set(self,val):
-        self.midiOut.write_short(0xb0,0x30+self.channel,val)
+        self.surface.setRing(self.local,val)
 
 class ScribbleStripLine(XtouchControl):
-    def __init__(self,channel,midiIn,midiOut,lineNumber,debugMode=False):
-        self.channel=channel
+    __slots__=("lineNumber","text")
+
+    def __init__(self,controls,channel,lineNumber):
         self.lineNumber=lineNumber
-        self.name="Scribble Strip %d Line %d"%(channel,lineNumber)
-        XtouchControl.__init__(self,channel,midiIn,midiOut,debugMode)
         self.text=""
-        self.blinkState=0
-        self.blinkPeriod=0
+        XtouchControl.__init__(self,controls,channel)
+
+    @property
+    def name(self):
+        return "Scribble Strip %d Line %d"%(self.channel,self.lineNumber)
 
     def update(self):
-        a=[0xf0,0x00,0x00,0x66,0x15,0x12]
-        a.append(self.channel*7+(self.lineNumber*56))     #Write the line, starting at index 0+7*channel; when i=1, write the second line starting at 56+7*channel
-        for i in range(7):                  #The text field is 7 characters long
-            if i<len(self.text):
-                ch=self.text[i]      
-            else:
-                ch=" "                      #Pad any remaining characters with spaces
-            a.append(ord(ch))
-        a.append(0xf7)
-        self.midiOut.write_sys_ex(0,a)
+        self.surface.setText(self.local,self.lineNumber,self.text)
 
     def blankDisplay(self):                     #Blanks the display but does not delete the stored strings, used by blink.
-            a=[0xf0,0x00,0x00,0x66,0x15,0x12]
-            a.append(self.channel*7+(self.lineNumber*56))     #When i=0, write the first line, starting at index 0+7*channel; when i=1, write the second line starting at 56+7*channel
-            for j in range(7):                  #The text field is 7 characters long
-                a.append(ord(" "))
-            a.append(0xf7)
-            self.midiOut.write_sys_ex(0,a)
+        self.surface.setText(self.local,self.lineNumber,"")
 
     def setText(self,text):
         self.text=text
@@ -165,232 +217,515 @@ class ScribbleStripLine(XtouchControl):
             self.blankDisplay()
 
 class Button(XtouchControl):
-    def __init__(self,channel,midiIn,midiOut,number,pressAndHoldDuration,doublePressDuration,boundHandlers,debugMode=False):
+    __slots__=("number","source","event","ledControl","onPress","onRelease","onPressAndHold","onDoublePress","onTriplePress")
+
+    def __init__(self,controls,channel,number):
         self.number=number
-        self.boundHandlers=boundHandlers
-        self.channel=channel
-        self.pressAndHoldDuration=pressAndHoldDuration
-        self.doublePressDuration=doublePressDuration
-        self.name="Button %d number %d"%(channel,number)
-        XtouchControl.__init__(self,channel,midiIn,midiOut,debugMode)
-        self.led=ButtonLed(self.channel,midiIn,midiOut,self.number)
-        self.lastPress=0
+        self.source=SOURCES_PER_CHANNEL*channel+1+number
+        self.ledControl=None
+        self.event=XtouchEvent(self,channel=channel,number=number)
+        XtouchControl.__init__(self,controls,channel)
+        controls.gestures.targets[self.source]=self
+        self.resolveHandlers()
+
+    @property
+    def name(self):
+        return "Button %d number %d"%(self.channel,self.number)
+
+    @property
+    def led(self):      #Made the first time it's asked for; most buttons never light theirs
+        if self.ledControl is None: self.ledControl=ButtonLed(self.controls,self.channel,self.number)
+        return self.ledControl
+
+    def resolveHandlers(self):
+        handlers=self.controls.boundHandlers[self.channel]
+        self.onPress=handlers.get("ButtonPress{}".format(self.number))
+        self.onRelease=handlers.get("ButtonRelease{}".format(self.number))
+        self.onPressAndHold=handlers.get("ButtonPressAndHold{}".format(self.number))
+        self.onDoublePress=handlers.get("ButtonDoublePress{}".format(self.number))
+        self.onTriplePress=handlers.get("ButtonTriplePress{}".format(self.number))
+
+    def isBound(self):      #Chord members have to be decoded even when they have no handlers of their own
+        return (self.onPress is not None) or (self.onRelease is not None) or (self.onPressAndHold is not None) or (self.onDoublePress is not None) or (self.onTriplePress is not None) or (self.source in self.controls.gestures.chords)
 
     def pressHandler(self):
-        if self.debug: print("Button channel {} number {} pressed".format(self.channel,self.number))
-#        print("Button channel {} number {} pressed".format(self.channel,self.number))
-        self.t=threading.Timer(self.pressAndHoldDuration,self.pressAndHoldHandler)
-        self.t.start()
-        if "ButtonPress{}".format(self.number) in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            retval["number"]=self.number
-            self.boundHandlers[self.channel]["ButtonPress{}".format(self.number)](retval)
+        if self.controls.debug: log.debug("Button channel %d number %d pressed",self.channel,self.number)
+        self.controls.gestures.press(self.source,self.onPressAndHold is not None)
+        if self.onPress is not None: self.onPress(self.event)
 
     def releaseHandler(self):
-        if self.debug: print("Button channel {} number {} released".format(self.channel,self.number))
-        self.t.cancel()
-        if (time.time()-self.lastPress)<self.doublePressDuration:
-            self.lastPress=0    #prevent multiple calls to double-press handler if somebody's button-happy
-            self.doublePressHandler()
-        else:
-            self.lastPress=time.time()
-        if "ButtonRelease{}".format(self.number) in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            retval["number"]=self.number
-            self.boundHandlers[self.channel]["ButtonRelease{}".format(self.number)](retval)
+        if self.controls.debug: log.debug("Button channel %d number %d released",self.channel,self.number)
+        taps=self.controls.gestures.release(self.source)
+        if taps==2: self.doublePressHandler()
+        elif taps==3: self.triplePressHandler()
+        if self.onRelease is not None: self.onRelease(self.event)
 
     def pressAndHoldHandler(self):
-        if self.debug: print("Button channel {} number {} press and hold".format(self.channel,self.number))
-        if "ButtonPressAndHold{}".format(self.number) in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            retval["number"]=self.number
-            self.boundHandlers[self.channel]["ButtonPressAndHold{}".format(self.number)](retval)
+        if self.controls.debug: log.debug("Button channel %d number %d press and hold",self.channel,self.number)
+        if self.onPressAndHold is not None: self.onPressAndHold(self.event)
 
     def doublePressHandler(self):
-        if self.debug: print("Button channel {} number {} double press".format(self.channel,self.number))
-        if "ButtonDoublePress{}".format(self.number) in self.boundHandlers[self.channel]:
-            retval={}
-            retval["obj"]=self
-            retval["channel"]=self.channel
-            retval["number"]=self.number
-            self.boundHandlers[self.channel]["ButtonDoublePress{}".format(self.number)](retval)
+        if self.controls.debug: log.debug("Button channel %d number %d double press",self.channel,self.number)
+        if self.onDoublePress is not None: self.onDoublePress(self.event)
 
-class ButtonLed(XtouchControl):
-    def __init__(self,channel,midiIn,midiOut,number,debugMode=False):
-        self.number=number
-        self.channel=channel
-        self.name="Button LED %d number %d"%(channel,number)
-        XtouchControl.__init__(self,channel,midiIn,midiOut,debugMode)
-
-    def blink(self,blinkState):
-        ledNumber=self.channel+(8*self.number)
-        if blinkState>0:
-            self.midiOut.write_short(0x90,ledNumber,0x7f)    
-        else:
-            self.midiOut.write_short(0x90,ledNumber,0x00)    
+    def triplePressHandler(self):
+        if self.controls.debug: log.debug("Button channel %d number %d triple press",self.channel,self.number)
+        if self.onTriplePress is not None: self.onTriplePress(self.event)
 
-class VuBar(XtouchControl):
-    def __init__(self,channel,midiIn,midiOut,serviceInterval=.1,debugMode=False):
-        self.channel=channel
-        self.serviceInterval=serviceInterval
-        self.name="VU Bar %d"%channel
-        self.t=None
-        self.val=0
-        XtouchControl.__init__(self,channel,midiIn,midiOut,debugMode)
+class ButtonLed(XtouchControl):
+    __slots__=("number",)
 
-    def set(self,val):
-        self.val=val
-        if self.val!=0:
-            self.midiOut.write_short(0xd0,16*self.channel+self.val,0x00)
-            self.t=threading.Timer(self.serviceInterval,self.timerService)
-            self.t.start()
-        else:
-            self.t.cancel()
+    def __init__(self,controls,channel,number):
+        self.number=number
+        XtouchControl.__init__(self,controls,channel)
 
-    def timerService(self):
-        self.midiOut.write_short(0xd0,16*self.channel+self.val,0x00)
-        self.t=threading.Timer(self.serviceInterval,self.timerService)
-        self.t.start()
+    @property
+    def name(self):
+        return "Button LED %d number %d"%(self.channel,self.number)
 
-class Fader(XtouchControl):
-    def __init__(self,channel,midiIn,midiOut,debugMode=False):
-        self.channel=channel
-        self.name="Fader %d"%channel
-        XtouchControl.__init__(self,channel,midiIn,midiOut,debugMode)
+    def blink(self,blinkState):
+        self.surface.setLed(self.local+(8*self.number),blinkState>0)
+
+class VuBar(XtouchControl):      #The meters themselves are driven by the shared MeterBank
+    __slots__=()
+
+    @property
+    def name(self):
+        return "VU Bar %d"%self.channel
+
+    @property
+    def val(self):
+        return self.controls.meterLevel[self.channel]
+
+    def set(self,val):      #Stays lit at val until set again
+        self.controls.meterLevel[self.channel]=int(val)
+        self.controls.meters.set(self.channel,val)
+
+    def feed(self,val):     #A sample of a live level: held briefly at its peak, then falls
+        self.controls.meters.feed(self.channel,val)
+
+class Fader(XtouchControl):   #Who owns the fader: the hand while it's touched, otherwise Eos, with the motor's own echoes kept out of both directions
+    __slots__=()
+
+    @property
+    def name(self):
+        return "Fader %d"%self.channel
+
+    @property
+    def state(self):
+        return FADER_STATE_NAMES[self.controls.faderState[self.channel]]
+
+    @property
+    def position(self):
+        return self.controls.faderPosition[self.channel]
+
+    def touch(self):
+        self.controls.faderState[self.channel]=FADER_TOUCHED
+
+    def release(self):
+        controls=self.controls
+        controls.faderState[self.channel]=FADER_RELEASED
+        controls.faderSince[self.channel]=time.monotonic()
+
+    def handMoved(self,raw):    #False if this level report is the motor, or nothing new
+        controls=self.controls
+        fader=self.channel
+        if controls.faderState[fader]==FADER_MOTOR:
+            if (time.monotonic()-controls.faderSince[fader]<FADER_ECHO_WINDOW) or (abs(raw-controls.faderTarget[fader])<=FADER_ECHO_TOLERANCE):
+                controls.faderSuppressed[4*fader+SUPPRESSED_ECHO]+=1
+                return False
+            controls.faderState[fader]=FADER_IDLE   #Moved without a touch and well away from where the motor left it
+        position=controls.faderPosition
+        if raw==position[fader]:
+            controls.faderSuppressed[4*fader+SUPPRESSED_UNCHANGED]+=1
+            return False
+        position[fader]=raw
+        return True
+
+    def motorMove(self,raw):    #False if Eos shouldn't move the motor right now
+        controls=self.controls
+        fader=self.channel
+        state=controls.faderState[fader]
+        if state==FADER_TOUCHED:
+            controls.faderSuppressed[4*fader+SUPPRESSED_TOUCHED]+=1
+            return False
+        now=time.monotonic()
+        if state==FADER_RELEASED and now-controls.faderSince[fader]<FADER_RELEASE_GUARD:
+            controls.faderSuppressed[4*fader+SUPPRESSED_RELEASED]+=1
+            return False
+        position=controls.faderPosition[fader]
+        if position!=FADER_UNKNOWN and abs(raw-position)<=FADER_DEADBAND:
+            controls.faderSuppressed[4*fader+SUPPRESSED_UNCHANGED]+=1
+            return False
+        controls.faderState[fader]=FADER_MOTOR
+        controls.faderSince[fader]=now
+        controls.faderTarget[fader]=raw
+        controls.faderPosition[fader]=raw
+        return True
+
+    def stats(self):
+        return self.controls.faderStats([self.channel])
 
 class Channel(object):
-    def __init__(self,channel,midiIn,midiOut,pressAndHoldDuration,doublePressDuration,boundHandlers,debugMode=False):
-        self.debug=debugMode
-        self.boundHandlers=boundHandlers
+    __slots__=("channelNumber","knob","knobRing","scribbleStrip","button","vuBar","fader")
+
+    def __init__(self,controls,channel):
         self.channelNumber=channel
-        self.knob=Knob(channel,midiIn,midiOut,pressAndHoldDuration,doublePressDuration,boundHandlers,debugMode=debugMode)
-        self.knobRing=KnobRing(channel,midiIn,midiOut,debugMode=debugMode)
-        self.scribbleStrip=[ScribbleStripLine(channel,midiIn,midiOut,0),ScribbleStripLine(channel,midiIn,midiOut,1)]
-        self.button=[]
-        for i in range(4):
-            self.button.append(Button(channel,midiIn,midiOut,i,pressAndHoldDuration,doublePressDuration,boundHandlers,debugMode))
-        self.vuBar=VuBar(channel,midiIn,midiOut)
-        self.fader=Fader(channel,midiIn,midiOut)
+        self.knob=Knob(controls,channel)
+        self.knobRing=KnobRing(controls,channel)
+        self.scribbleStrip=(ScribbleStripLine(controls,channel,0),ScribbleStripLine(controls,channel,1))
+        self.button=tuple([Button(controls,channel,i) for i in range(4)])
+        self.vuBar=VuBar(controls,channel)
+        self.fader=Fader(controls,channel)
+
+class Device(object):      #One extender: its ports, its output shadow and where its 8 channels sit in the global channel space
+    def __init__(self,index,midiIn,midiOut,scheduler,onError=None):
+        self.index=index
+        self.offset=8*index
+        self.midiIn=midiIn
+        self.midiOut=midiOut
+        self.connected=True
+        self.lost=False             #Really went away, so it needs a full repaint when it's back; a unit only closed for a rescan doesn't
+        self.surface=SurfaceState(midiOut,scheduler,onError)
+        self.queue=None
+        self.decodeTable=None
 
 class XTouch(object):
-    def __init__(self,pressAndHoldDuration=1,doublePressDuration=.5,debugMode=False):
+    def __init__(self,pressAndHoldDuration=1,doublePressDuration=.5,debugMode=False,midiIn=None,midiOut=None,autoStart=True,deviceNames=DEVICE_NAMES,ports=None,maxDevices=None,backend=None,metrics=None):
         self.debug=debugMode
-        self.midiOut=None
-        self.midiIn=None
-        self.boundHandlers=[{} for sub in range(8)]
+        if debugMode: enableDebugLogging()
+        self.backend=backend if backend is not None else PygameBackend()     #Anything with devices(), openInput(), openOutput() and time(), see midibackend
+        self.scheduler=Scheduler()
+        self.deviceNames=deviceNames
+        self.ports=ports
+        self.reconnectable=(midiIn is None) or (midiOut is None)    #Ports handed to us directly can't be reopened
+        self.reconnectLock=threading.Lock()
+        self.reconnectJob=None
+        self.reconnectDelay=RECONNECT_PERIOD
+        self.reconnects=0
+        if self.reconnectable: ports=self.openDevices(deviceNames,ports,maxDevices)
+        elif isinstance(midiIn,list): ports=list(zip(midiIn,midiOut))
+        else: ports=[(midiIn,midiOut)]
+        self.devices=[Device(i,ports[i][0],ports[i][1],self.scheduler,functools.partial(self.deviceLost,i)) for i in range(len(ports))]
+        self.channelCount=8*len(self.devices)
+        self.midiIn=self.devices[0].midiIn
+        self.midiOut=self.devices[0].midiOut
+        self.surface=self.devices[0].surface
+        self.boundHandlers=[{} for sub in range(self.channelCount)]
+        self.bindListeners=[]       #Called as listener(xt) after every bind, e.g. so eos can subscribe to what the handlers need
         self.blinkTable={}
         self.blinkStep=0
-        pygame.midi.init()
-        deviceCount=pygame.midi.get_count()
-        for i in range(deviceCount):
-            if self.debug: print(pygame.midi.get_device_info(i))
-            if self.debug: print(pygame.midi.get_device_info(i)[2])
-            if pygame.midi.get_device_info(i)[1].decode("utf8")=="X-Touch-Ext":
-                if (pygame.midi.get_device_info(i)[2]==1):
-                    if self.debug: print("X-Touch Extender input found at device %d"%i)
-                    if pygame.midi.get_device_info(i)[4]==0: self.midiIn = pygame.midi.Input(i)
-                    else: raise ExternalDeviceNotFound('X-Touch Extender input device busy.')
-                elif (pygame.midi.get_device_info(i)[3]==1):
-                    if self.debug: print("X-Touch Extender output found at device %d"%i)
-                    if pygame.midi.get_device_info(i)[4]==0: self.midiOut = pygame.midi.Output(i)
-                    else: raise ExternalDeviceNotFound('X-Touch Extender output device busy.')
-        if self.midiOut==None: raise ExternalDeviceNotFound('Couldn\'t find X-Touch Extender output device.')
-        if self.midiIn==None: raise ExternalDeviceNotFound('Couldn\'t find X-Touch Extender input device.')
-        self.knobVal=[0,0,0,0,0,0,0,0]
-        self.channel=[]
-        for i in range(8):
-            self.channel.append(Channel(i,self.midiIn,self.midiOut,pressAndHoldDuration,doublePressDuration,self.boundHandlers,debugMode=debugMode))
-        self.lastFastTime=time.time()
-        self.lastSlowTime=time.time()
-        self.fastTimerCallback()
-        self.slowTimerCallback()
-
-    def bind(self,eventName,handler,channels=list(range(8))):
+        self.midiClock=self.backend.time
+        self.motion=KnobMotion(self.channelCount)
+        self.meters=MeterBank(self.scheduler,[device.surface for device in self.devices])
+        self.gestures=GestureRecognizer(self.scheduler,SOURCES_PER_CHANNEL*self.channelCount,pressAndHoldDuration,doublePressDuration)
+        self.controls=ControlState(self.channelCount,[device.surface for device in self.devices],self.gestures,self.boundHandlers,self.motion,self.meters,debugMode=debugMode)
+        self.channel=[Channel(self.controls,ch) for ch in range(self.channelCount)]
+        self.faderEvent=[XtouchEvent(self,fader=i) for i in range(self.channelCount)]
+        self.metrics=metrics if metrics is not None else Metrics()     #Pass Metrics(enabled=True) to have the pump and scheduler time themselves
+        self.inputLatency=self.metrics.histogram("midiToHandler","ms")     #PortMidi timestamps are in milliseconds
+        self.handlerDuration=self.metrics.histogram("handlerDuration")
+        self.pumpDepth=self.metrics.histogram("pumpDepth","events")
+        if self.metrics.enabled: self.scheduler.lateness=self.metrics.histogram("tickLateness")
+        self.pumpPending=False
+        self.midiReader=MidiReader([device.midiIn for device in self.devices],self.midiReady,onError=self.deviceLost)
+        for device in self.devices: device.queue=self.midiReader.queues[device.index]
+        self.resolveHandlers()
+        self.slowTimer=self.scheduler.every(SLOW_TIMER_PERIOD,self.blinkProcess)
+        self.metrics.gauge("midiQueued",self.midiReader.queued)
+        self.metrics.gauge("timers",self.timerStats)
+        self.metrics.gauge("input",self.inputStats)
+        self.metrics.gauge("output",self.outputStats)
+        self.metrics.gauge("faderFeedback",self.faderStats)
+        self.metrics.gauge("meters",self.meters.stats)
+        self.metrics.gauge("gestures",self.gestures.stats)
+        self.metrics.gauge("devices",self.deviceStats)
+        if autoStart: self.start()
+
+    def start(self):            #Not needed under runtime.run(), which drives the scheduler and reader from an asyncio loop instead
+        self.scheduler.start()
+        self.midiReader.start()
+
+    def openDevices(self,deviceNames,ports,maxDevices):  #ports is a list of (input id,output id) pairs; by default every extender found is used
+        info=self.backend.devices()
+        if self.debug:
+            for i in range(len(info)): log.debug("MIDI device %d: %r",i,info[i])
+        if ports is None:
+            inputs=[i for i in range(len(info)) if info[i][1].decode("utf8") in deviceNames and info[i][2]==1]
+            outputs=[i for i in range(len(info)) if info[i][1].decode("utf8") in deviceNames and info[i][3]==1]
+            if not outputs: raise ExternalDeviceNotFound('Couldn\'t find X-Touch Extender output device.')
+            if not inputs: raise ExternalDeviceNotFound('Couldn\'t find X-Touch Extender input device.')
+            ports=list(zip(inputs,outputs))     #Units enumerate in the same order on both sides, so the n-th input goes with the n-th output
+        if maxDevices is not None: ports=ports[:maxDevices]
+        opened=[]
+        for (inputId,outputId) in ports:
+            if self.debug: log.debug("X-Touch Extender %d on input device %d, output device %d",len(opened),inputId,outputId)
+            if info[inputId][4]!=0: raise ExternalDeviceNotFound('X-Touch Extender input device busy.')
+            if info[outputId][4]!=0: raise ExternalDeviceNotFound('X-Touch Extender output device busy.')
+            opened.append((self.backend.openInput(inputId),self.backend.openOutput(outputId)))
+        return opened
+
+    def deviceLost(self,index,error):      #From the reader thread or a failed surface write: stop using the unit and start trying to reopen it
+        with self.reconnectLock:
+            device=self.devices[index]
+            if device.lost: return
+            device.connected=False
+            device.lost=True
+            self.midiReader.setInput(index,None)
+            device.surface.midiOut=None     #Its state keeps updating, so the repaint on reconnect shows whatever it missed
+            for fader in range(device.offset,device.offset+8):     #A release can't reach us now, so don't leave a fader owned by a hand forever
+                if self.controls.faderState[fader]==FADER_TOUCHED: self.channel[fader].fader.release()
+            log.warning("X-Touch Extender %d lost: %s",index,error)
+            if self.reconnectable and self.reconnectJob is None:
+                self.reconnectDelay=RECONNECT_PERIOD
+                self.reconnectJob=self.scheduler.after(self.reconnectDelay,self.reconnect)
+
+    def reconnect(self):    #Scheduler job while any unit is missing, backing off while it stays missing
+        if self.midiReader.readBatch(): self.midiReady()     #Keep whatever the healthy units sent before their ports are closed
+        with self.reconnectLock:
+            self.reconnectJob=None
+            for device in self.devices:     #PortMidi only rescans by restarting, which closes every port, so every unit is reopened
+                self.midiReader.setInput(device.index,None)
+                device.surface.midiOut=None
+                for port in (device.midiIn,device.midiOut):
+                    try:
+                        port.close()
+                    except Exception:
+                        pass
+            survivors=[device for device in self.devices if device.connected]
+            try:
+                self.backend.rescan()
+                ports=self.openDevices(self.deviceNames,self.ports,len(self.devices))
+            except Exception as error:
+                ports=[]
+                if self.debug: log.debug("Reconnect failed: %s",error)
+            if len(ports)==len(self.devices): targets=self.devices
+            elif len(ports)==len(survivors): targets=survivors     #Still missing the same units; the rest enumerate in the same order as before
+            else:
+                for (midiIn,midiOut) in ports:
+                    midiIn.close()
+                    midiOut.close()
+                targets=[]
+                ports=[]
+                for device in survivors:    #Can't tell which ports are whose, so these stay detached until the count adds up again
+                    device.connected=False
+                if survivors: log.warning("Found an unexpected set of X-Touch Extenders, retrying")
+            for (device,(midiIn,midiOut)) in zip(targets,ports):
+                device.midiIn=midiIn
+                device.midiOut=midiOut
+                device.connected=True
+                device.surface.midiOut=midiOut
+                if device.lost:
+                    log.warning("X-Touch Extender %d reconnected",device.index)
+                    device.lost=False
+                    self.repaintDevice(device)      #Everything it should be showing, in one flush
+                else:
+                    device.surface.resume()         #Still showing what it was; just send whatever changed while its ports were closed
+                self.midiReader.setInput(device.index,midiIn)
+            self.midiIn=self.devices[0].midiIn
+            self.midiOut=self.devices[0].midiOut
+            if len(targets)==len(self.devices):
+                self.reconnects+=1
+                self.reconnectDelay=RECONNECT_PERIOD
+            else:
+                self.reconnectDelay=min(2*self.reconnectDelay,RECONNECT_MAX_PERIOD)
+                self.reconnectJob=self.scheduler.after(self.reconnectDelay,self.reconnect)
+
+    def deviceStats(self):
+        retval={}
+        retval["units"]=len(self.devices)
+        retval["connected"]=sum([1 for device in self.devices if device.connected])
+        retval["reconnects"]=self.reconnects
+        return retval
+
+    def bind(self,eventName,handler,channels=None):   #channels is a channel number, a list of them, or None for every channel on every unit
+        if channels is None: channels=list(range(self.channelCount))
         if isinstance(channels,int):
             self.boundHandlers[channels][eventName]=handler
-            return 0
         elif isinstance(channels,list):
             for i in channels:
                 self.boundHandlers[i][eventName]=handler
-            return 0
         else: return -1
-
-    def fastTimerCallback(self):
-        self.midiMessagePump()
-        presentTime=time.time()
-        nextTime=self.lastFastTime+FAST_TIMER_PERIOD
-        self.lastFastTime=nextTime
-        delayTime=nextTime-presentTime
-        threading.Timer(delayTime,self.fastTimerCallback).start()
-
-    def slowTimerCallback(self):
-        self.blinkProcess()
-        presentTime=time.time()
-        nextTime=self.lastSlowTime+SLOW_TIMER_PERIOD
-        self.lastSlowTime=nextTime
-        delayTime=nextTime-presentTime
-        threading.Timer(delayTime,self.slowTimerCallback).start()
+        self.resolveHandlers()
+        for listener in self.bindListeners: listener(self)
+        return 0
+
+    def unbind(self,eventName,channels=None):
+        if channels is None: channels=list(range(self.channelCount))
+        if isinstance(channels,int): channels=[channels]
+        for i in channels: self.boundHandlers[i].pop(eventName,None)
+        self.resolveHandlers()
+        for listener in self.bindListeners: listener(self)
+
+    def pressSource(self,eventName,channel):      #"KnobPress" or "ButtonPress0".."ButtonPress3" on a channel -> its gesture source
+        if eventName=="KnobPress": return SOURCES_PER_CHANNEL*channel
+        if eventName.startswith("ButtonPress") and eventName[11:].isdigit(): return SOURCES_PER_CHANNEL*channel+1+int(eventName[11:])
+        raise ValueError("Not a press source: {}".format(eventName))
+
+    def bindChord(self,members,handler):     #members is a list of (press event name,channel), e.g. [("ButtonPress3",6),("ButtonPress3",7)]; handler fires once all are down together
+        sources=[self.pressSource(name,channel) for (name,channel) in members]
+        self.gestures.removeChord(sources)
+        self.gestures.addChord(sources,handler,XtouchEvent(tuple(members),channel=members[-1][1]))
+        self.resolveHandlers()
+
+    def unbindChord(self,members):
+        self.gestures.removeChord([self.pressSource(name,channel) for (name,channel) in members])
+        self.resolveHandlers()
+
+    def setPressTiming(self,eventName,channels=None,hold=None,multiPress=None):   #Hold time and double/triple press window for one kind of press source, in seconds
+        if channels is None: channels=list(range(self.channelCount))
+        if isinstance(channels,int): channels=[channels]
+        for channel in channels: self.gestures.setTiming(self.pressSource(eventName,channel),hold,multiPress)
+
+    def boundEventNames(self):
+        names=set()
+        for handlers in self.boundHandlers: names.update(handlers)
+        return names
+
+    def resolveHandlers(self):  #Refresh every control's handler references, then rebuild the decode table to match
+        for ch in self.channel:
+            ch.knob.resolveHandlers()
+            for button in ch.button: button.resolveHandlers()
+        self.onFaderPress=[handlers.get("FaderPress") for handlers in self.boundHandlers]
+        self.onFaderRelease=[handlers.get("FaderRelease") for handlers in self.boundHandlers]
+        self.onFaderLevel=[handlers.get("FaderLevel") for handlers in self.boundHandlers]
+        for device in self.devices: device.decodeTable=self.buildDecodeTable(device)
+
+    def buildDecodeTable(self,device): #table[status][control][value] -> callable(control,value), None for events we don't handle
+        emptyRow=[None]*256
+        emptyRows=[emptyRow]*256
+        table=[emptyRows]*256
+        ignoredRow=[None]*256
+        ignoredRow[127]=ignoredRow[0]=lambda control,value: None
+        notes=list(emptyRows)
+        for i in range(8):
+            channel=self.channel[device.offset+i]
+            knob=channel.knob
+            notes[32+i]=self.switchRow(knob.pressHandler,knob.releaseHandler)
+            notes[104+i]=self.switchRow(functools.partial(self.faderPressHandler,device.offset+i),functools.partial(self.faderReleaseHandler,device.offset+i))
+            for j in range(4):
+                button=channel.button[j]
+                if button.isBound(): notes[8*j+i]=self.switchRow(button.pressHandler,button.releaseHandler)
+                else: notes[8*j+i]=ignoredRow    #Nobody's listening, skip the hold timer and double-press bookkeeping
+        table[0x90]=notes
+        commands=list(emptyRows)
+        for i in range(8):
+            knob=self.channel[device.offset+i].knob
+            row=list(emptyRow)
+            for v in range(1,64): row[v]=self.rotationEntry(knob.incrementHandler,v)
+            for v in range(65,128): row[v]=self.rotationEntry(knob.decrementHandler,v-64)
+            commands[16+i]=row
+        table[0xb0]=commands
+        for i in range(8):
+            level=self.faderLevelEntry(device,i)
+            row=[level]*128+[None]*128
+            table[0xe0+i]=[row]*128+[emptyRow]*128
+        return table
+
+    def switchRow(self,press,release):   #Note-on 127 is a press, 0 a release, anything else is unhandled
+        row=[None]*256
+        row[127]=lambda control,value: press()
+        row[0]=lambda control,value: release()
+        return row
+
+    def rotationEntry(self,handler,magnitude):
+        return lambda control,value: handler(magnitude)
+
+    def faderLevelEntry(self,device,local):
+        surface=device.surface
+        fader=device.offset+local
+        control=self.channel[fader].fader
+        def entry(lsb,msb):
+            raw=(msb<<7)|lsb
+            surface.noteFader(local,raw)
+            if control.handMoved(raw): self.faderLevelHandler(fader,raw)
+        return entry
+
+    def stop(self):
+        self.midiReader.stop()
+        self.scheduler.stop()
+
+    def timerStats(self):
+        retval=self.scheduler.stats()
+        retval["slow"]=self.slowTimer.stats()
+        return retval
+
+    def outputStats(self):
+        retval={}
+        for device in self.devices:
+            stats=device.surface.stats()
+            for key in stats: retval[key]=retval.get(key,0)+stats[key]
+        return retval
+
+    def inputStats(self):
+        retval=self.inputLatency.snapshot()
+        retval["batches"]=self.midiReader.batches
+        retval["events"]=self.midiReader.events
+        retval["queued"]=self.midiReader.queued()
+        return retval
+
+    def midiReady(self):        #Runs on the reader thread: hand the queued events over to the scheduler thread for dispatch
+        if not self.pumpPending:
+            self.pumpPending=True
+            self.scheduler.callSoon(self.midiMessagePump)
 
     def midiMessagePump(self):
-        while(self.midiIn.poll()):
-            event=self.midiIn.read(1)
-#            if self.debug: print(event)
-            (eventType,eventControl,eventValue)=event[0][0][:3]
-    #        if self.debug: print("Type=%x, Control=%d, Value=%d"%(eventType,eventControl,eventValue))
-            if (eventType==0x90):                #Note
-                if ((eventControl>=32)&(eventControl<=39)):
-                    channel=eventControl-32
-                    if (eventValue==0):
-                        self.channel[channel].knob.releaseHandler()
-                    elif (eventValue==127):
-                        self.channel[channel].knob.pressHandler()
-                    else:
-                        self.unhandledEvent("Unhandled knob press event Type=0x%x Control=0x%x Value=0x%x"%(eventType,eventControl,eventValue))
-                elif ((eventControl>=0)&(eventControl<=31)):
-                    row=int(eventControl/8)
-                    col=eventControl-(row*8)
-                    if (eventValue==0):
-                        self.channel[col].button[row].releaseHandler()
-                    elif (eventValue==127):
-                        self.channel[col].button[row].pressHandler()
-                    else:
-                        self.unhandledEvent("Unhandled button event Type=0x%x Control=0x%x Value=0x%x"%(eventType,eventControl,eventValue))
-                elif ((eventControl>=104)&(eventControl<=111)):
-                    fader=(int(eventControl)-104)
-                    if eventValue==127:
-                        self.faderPressHandler(fader)
-                    elif eventValue==0:
-                        self.faderReleaseHandler(fader)
-                    else:
-                        self.unhandledEvent("Unhandled fader touch value Type=0x%x Control=0x%x Value=0x%x"%(eventType,eventControl,eventValue))
+        self.pumpPending=False
+        try:
+            if self.metrics.enabled:
+                self.instrumentedPump()
+                return
+            for device in self.devices:
+                queue=device.queue
+                table=device.decodeTable
+                while(queue):
+                    event=queue.popleft()
+#                    if self.debug: log.debug("%r",event)
+                    (eventType,eventControl,eventValue)=event[0][:3]
+                    handler=table[eventType][eventControl][eventValue]
+                    if handler is not None: handler(eventControl,eventValue)
+                    elif self.debug: self.unhandledEvent(self.describeUnhandled(eventType,eventControl,eventValue))
+        finally:
+            if any([device.queue for device in self.devices]): self.midiReady()     #A handler raised: the scheduler logs it, and the rest still gets dispatched
+
+    def instrumentedPump(self):     #midiMessagePump plus timing; kept separate so the uninstrumented loop pays nothing for it
+        clock=self.midiClock
+        latency=self.inputLatency
+        duration=self.handlerDuration
+        perfCounter=time.perf_counter
+        events=0
+        unhandled=0
+        for device in self.devices:
+            queue=device.queue
+            table=device.decodeTable
+            self.pumpDepth.record(len(queue))
+            while(queue):
+                event=queue.popleft()
+                latency.record(clock()-event[1])
+                events+=1
+                (eventType,eventControl,eventValue)=event[0][:3]
+                handler=table[eventType][eventControl][eventValue]
+                if handler is not None:
+                    start=perfCounter()
+                    handler(eventControl,eventValue)
+                    duration.record((perfCounter()-start)*1000000)
                 else:
-                    self.unhandledEvent("Unhandled note command Type=0x%x Control=0x%x Value=0x%x"%(eventType,eventControl,eventValue))
-
-            elif (eventType==0xB0):                #Command Change
-                if ((eventControl>=16)&(eventControl<=23)):
-                    channel=eventControl-16
-                    if (eventValue<64):
-                        self.channel[channel].knob.incrementHandler(eventValue)
-                    elif (eventValue>=65):
-                        self.channel[channel].knob.decrementHandler(eventValue-64)
-                    else:
-                        self.unhandledEvent("Unhandled knob change command Type=0x%x Control=0x%x Value=0x%x"%(eventType,eventControl,eventValue))
-                else:
-                    self.unhandledEvent("Unhandled command change command Type=0x%x Control=0x%x Value=0x%x"%(eventType,eventControl,eventValue))
-            
-            elif ((eventType>=0xe0)&(eventType<=0xe7)):
-                fader=eventType-0xe0
-                faderValue=eventValue*127+eventControl
-                self.faderLevelHandler(fader,faderValue)
-
-            else:
-                self.unhandledEvent("Unhandled MIDI event type Type=0x%x Control=0x%x Value=0x%x"%(eventType,eventControl,eventValue))
+                    unhandled+=1
+                    if self.debug: self.unhandledEvent(self.describeUnhandled(eventType,eventControl,eventValue))
+        self.metrics.count("midi.events",events)
+        self.metrics.count("midi.unhandled",unhandled)
+
+    def describeUnhandled(self,eventType,eventControl,eventValue):
+        if (eventType==0x90):                #Note
+            if ((eventControl>=32)&(eventControl<=39)): kind="Unhandled knob press event"
+            elif ((eventControl>=0)&(eventControl<=31)): kind="Unhandled button event"
+            elif ((eventControl>=104)&(eventControl<=111)): kind="Unhandled fader touch value"
+            else: kind="Unhandled note command"
+        elif (eventType==0xB0):                #Command Change
+            if ((eventControl>=16)&(eventControl<=23)): kind="Unhandled knob change command"
+            else: kind="Unhandled command change command"
+        else: kind="Unhandled MIDI event type"
+        return "%s Type=0x%x Control=0x%x Value=0x%x"%(kind,eventType,eventControl,eventValue)
 
     def blinkProcess(self):
         self.blinkStep+=1
@@ -401,37 +736,56 @@ class XTouch(object):
             entry.blink(blinkState)
         
     def faderPressHandler(self,fader):
-        if self.debug: print("Fader %d touch"%fader)
-        if "FaderPress" in self.boundHandlers[fader]:
-            retval={}
-            retval["obj"]=self
-            retval["fader"]=fader
-            self.boundHandlers[fader]["FaderPress"](retval)
+        if self.debug: log.debug("Fader %d touch",fader)
+        self.channel[fader].fader.touch()
+        handler=self.onFaderPress[fader]
+        if handler is not None: handler(self.faderEvent[fader])
 
     def faderReleaseHandler(self,fader):
-        if self.debug: print("Fader %d release"%fader)
-        if "FaderRelease" in self.boundHandlers[fader]:
-            retval={}
-            retval["obj"]=self
-            retval["fader"]=fader
-            self.boundHandlers[fader]["FaderRelease"](retval)
+        if self.debug: log.debug("Fader %d release",fader)
+        self.channel[fader].fader.release()
+        handler=self.onFaderRelease[fader]
+        if handler is not None: handler(self.faderEvent[fader])
 
     def faderLevelHandler(self,fader,level):
-        if self.debug: print("Fader %d level %d"%(fader,level))
-        if "FaderLevel" in self.boundHandlers[fader]:
-            retval={}
-            retval["obj"]=self
-            retval["fader"]=fader
-            retval["level"]=level
-            self.boundHandlers[fader]["FaderLevel"](retval)
+        if self.debug: log.debug("Fader %d level %d",fader,level)
+        handler=self.onFaderLevel[fader]
+        if handler is not None:
+            event=self.faderEvent[fader]
+            event.level=level
+            handler(event)
 
     def unhandledEvent(self,s):
-        if self.debug: print(s)
+        if self.debug: log.debug(s)
 
-    def setFader(self,fader,faderLevel):
+    def setFader(self,fader,faderLevel):   #Raw 14-bit level; ignored while the fader is touched, just released, or already there
         if (faderLevel>16256): faderLevel=16256
         if (faderLevel<0): faderLevel=0
-        self.midiOut.write_short(0xE0+fader,int((int(faderLevel))%128),int((int(faderLevel))/128))
+        faderLevel=int(faderLevel)
+        if self.channel[fader].fader.motorMove(faderLevel): self.devices[fader//8].surface.setFader(fader%8,faderLevel)
+
+    def faderStats(self):      #Level reports and motor moves suppressed by the fader ownership logic, summed over every fader
+        return self.controls.faderStats()
+
+    def feedMeter(self,meter,level):       #For level streams, e.g. from Eos; the meter holds the peak and falls on its own
+        self.meters.feed(meter,level)
+
+    def setTexts(self,line,texts,firstChannel=0):  #Sets several scribble strips at once; the changed characters go out in as few SysEx frames as possible
+        for i in range(len(texts)):
+            self.channel[firstChannel+i].scribbleStrip[line].text=texts[i]
+        i=0
+        while i<len(texts):     #Split the run at unit boundaries
+            channel=firstChannel+i
+            count=min(len(texts)-i,8-channel%8)
+            self.devices[channel//8].surface.setTexts(line,texts[i:i+count],channel%8)
+            i+=count
+
+    def repaint(self):
+        for device in self.devices: self.repaintDevice(device)
+
+    def repaintDevice(self,device):     #Faders under a hand are left where the hand has them
+        touched=[i for i in range(8) if self.controls.faderState[device.offset+i]==FADER_TOUCHED]
+        device.surface.repaint(touched)
 
     def addBlink(self,blinkMember,blinkPattern):
         self.blinkTable[blinkMember]=blinkPattern
\ No newline at end of file
@@ -0,0 +1,112 @@
+import math
+import threading
+import time
+
+MOTION_RING=8           #Recent rotation events remembered per knob
+MOTION_WINDOW=0.1       #Seconds of history the instantaneous rate is measured over
+MOTION_SMOOTHING=0.05   #EWMA time constant in seconds; a longer gap than this mostly forgets the old velocity
+CURVE_STEPS=64
+WHEEL_TICK=0.02         #Rotation within this long of the first event goes out as one wheel message
+
+class KnobMotion(object):       #Velocity of every knob in detents/sec, kept in flat arrays indexed by knob
+    def __init__(self,knobs,ring=MOTION_RING,window=MOTION_WINDOW,smoothing=MOTION_SMOOTHING):
+        self.ring=ring
+        self.window=window
+        self.smoothing=smoothing
+        self.times=[-1.0e9]*(knobs*ring)     #Ring buffers of (time,detents), knob k owns slots k*ring..k*ring+ring-1
+        self.detents=[0]*(knobs*ring)
+        self.position=[0]*knobs
+        self.velocity=[0.0]*knobs
+        self.last=[-1.0e9]*knobs
+
+    def update(self,knob,detents,now=None):     #Records a rotation and returns the smoothed velocity
+        if now is None: now=time.monotonic()
+        ring=self.ring
+        base=knob*ring
+        slot=base+self.position[knob]
+        self.times[slot]=now
+        self.detents[slot]=detents
+        self.position[knob]=(self.position[knob]+1)%ring
+        since=now-self.window
+        total=0
+        oldest=now
+        first=0
+        times=self.times
+        for i in range(base,base+ring):
+            if times[i]>since:
+                total+=self.detents[i]
+                if times[i]<oldest:
+                    oldest=times[i]
+                    first=self.detents[i]
+        if oldest<now: rate=(total-first)/(now-oldest)    #Detents since the oldest event we still remember, over the time they took
+        else: rate=total/self.window                        #A lone event: all we can say is it's slow
+        alpha=1.0-math.exp(-(now-self.last[knob])/self.smoothing)
+        self.last[knob]=now
+        velocity=self.velocity[knob]+alpha*(rate-self.velocity[knob])
+        self.velocity[knob]=velocity
+        return velocity
+
+class Curve(object):    #Wheel ticks per detent against velocity: fine up to the knee, rising to coarse at top, precomputed into a table
+    def __init__(self,fine=1.0,coarse=10.0,knee=40.0,top=1000.0,exponent=2.0,steps=CURVE_STEPS):
+        self.step=top/steps
+        self.table=[]
+        for i in range(steps+1):
+            velocity=i*self.step
+            if velocity<=knee: self.table.append(fine)
+            else: self.table.append(fine+(coarse-fine)*((velocity-knee)/(top-knee))**exponent)
+        self.last=steps
+
+    def gain(self,velocity):
+        i=int(velocity/self.step)
+        if i>self.last: i=self.last
+        return self.table[i]
+
+class Accelerator(object):      #Turns knob detents into wheel ticks through per-key curves and merges each tick's worth into one send
+    def __init__(self,scheduler,send,curves=None,default=None,tick=WHEEL_TICK):
+        self.scheduler=scheduler
+        self.send=send              #Called as send(key,ticks) from the scheduler thread, ticks a non-zero int
+        self.curves=curves if curves is not None else {}
+        self.default=default if default is not None else Curve()
+        self.tick=tick
+        self.pending={}
+        self.remainder={}           #Fractions of a tick carried over, so fine curves still add up
+        self.lock=threading.Lock()
+        self.job=None
+        self.lastFlush=0.0
+        self.events=0
+        self.sent=0
+
+    def rotate(self,key,detents,velocity,curve=None):     #detents is signed, velocity in detents/sec as KnobMotion reports it; curve overrides the lookup by key
+        if curve is None: curve=self.curves.get(key,self.default)
+        ticks=detents*curve.gain(velocity)
+        with self.lock:
+            self.events+=1
+            self.pending[key]=self.pending.get(key,0.0)+ticks
+            if self.job is None:
+                delay=self.lastFlush+self.tick-time.monotonic()
+                self.job=self.scheduler.after(max(delay,0),self.flush)
+
+    def flush(self):
+        with self.lock:
+            pending=self.pending
+            self.pending={}
+            self.job=None
+            self.lastFlush=time.monotonic()
+            out=[]
+            for key in pending:
+                remainder=self.remainder.get(key,0.0)
+                if remainder*pending[key]<0: remainder=0.0     #Changed direction: don't let the old leftovers eat the first detent
+                total=pending[key]+remainder
+                ticks=int(total)
+                self.remainder[key]=total-ticks
+                if ticks: out.append((key,ticks))
+        for (key,ticks) in out:
+            self.send(key,ticks)
+        self.sent+=len(out)
+
+    def stats(self):
+        retval={}
+        retval["events"]=self.events
+        retval["sent"]=self.sent
+        retval["pending"]=len(self.pending)
+        return retval
@@ -0,0 +1,439 @@
+import os
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from pythonosc import osc_packet
+from pythonosc import udp_client
+import XTouch
+import eos
+from metrics import Histogram,Metrics
+from midibackend import ReplayBackend
+from mapping import Mapper
+
+REPLAY_LEAD_IN=100     #ms before the first replayed event, so the reader and scheduler are up and running
+PROFILE=os.path.join(os.path.dirname(os.path.abspath(__file__)),"EOS_Automation.json")
+
+def syntheticStream(count,seed=1):     #A recorded-session-like mix of fader moves, knob turns, fader touches and buttons
+    rng=random.Random(seed)
+    events=[]
+    levels=[0]*8
+    for i in range(count):
+        r=rng.random()
+        ch=rng.randrange(8)
+        if r<0.40:
+            levels[ch]=max(0,min(16256,levels[ch]+rng.randint(-300,300)))
+            events.append([[0xe0+ch,levels[ch]%128,levels[ch]//128,0],i])
+        elif r<0.75:
+            v=rng.randint(1,6)
+            events.append([[0xb0,16+ch,v if rng.random()<0.5 else 64+v,0],i])
+        elif r<0.85:
+            events.append([[0x90,104+ch,127 if rng.random()<0.5 else 0,0],i])
+        else:
+            events.append([[0x90,8*rng.randrange(4)+ch,127 if rng.random()<0.5 else 0,0],i])
+    return events
+
+def makeSurface(captures=None,metrics=None):     #An XTouch on replayed input, one extender per capture; nothing runs until the caller starts it
+    backend=ReplayBackend(captures if captures is not None else [[]])
+    xt=XTouch.XTouch(backend=backend,autoStart=False,metrics=metrics)
+    noop=lambda arg:None
+    for name in ("FaderLevel","KnobIncrement","KnobDecrement","ButtonPress0"): xt.bind(name,noop)
+    xt.bind("ButtonPress3",noop,channels=7)
+    xt.bind("ButtonPressAndHold3",noop,channels=7)
+    return xt
+
+def wireBytes(xt):
+    return sum([device.midiOut.written for device in xt.devices])
+
+def pumpRate(xt,events):    #Events/sec through the decode table and handlers alone, no reader thread or scheduler
+    xt.midiClock=lambda:0
+    xt.devices[0].queue.extend(events)
+    start=time.perf_counter()
+    xt.midiMessagePump()
+    return len(events)/(time.perf_counter()-start)
+
+def controlBytes(root,seen=None):     #Memory held by the control tree: XTouch's own objects and the containers under them, each counted once
+    if seen is None: seen=set()
+    if id(root) in seen: return 0
+    seen.add(id(root))
+    size=sys.getsizeof(root)
+    if isinstance(root,(list,tuple)): return size+sum([controlBytes(item,seen) for item in root])
+    if isinstance(root,dict): return size+sum([controlBytes(key,seen)+controlBytes(root[key],seen) for key in root])
+    if isinstance(root,(str,int,float,array)) or root is None: return size
+    if type(root).__module__!="XTouch" or isinstance(root,XTouch.XTouch): return 0     #Scheduler, surfaces, handlers: not part of the tree
+    if hasattr(root,"__dict__"): size+=controlBytes(root.__dict__,seen)
+    for cls in type(root).__mro__:
+        for slot in getattr(cls,"__slots__",()):
+            if hasattr(root,slot): size+=controlBytes(getattr(root,slot),seen)
+    return size
+
+def benchControls(units=4,count=400000):    #The control tree of a four-extender rig: how big it is and how fast events get through it
+    tracemalloc.start()
+    xt=makeSurface([[] for unit in range(units)])
+    (allocated,peak)=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tree=controlBytes([xt.channel,getattr(xt,"controls",None)])
+    events=syntheticStream(count)
+    for i in range(len(events)): xt.devices[i%units].queue.append([events[i][0],0])
+    xt.midiClock=lambda:0
+    start=time.perf_counter()
+    xt.midiMessagePump()
+    rate=count/(time.perf_counter()-start)
+    print("controls: %d units, %d channels, control tree %d bytes (%d per channel), %d bytes allocated building the surface"%(units,len(xt.channel),tree,tree//len(xt.channel),allocated))
+    print("controls: %d events across %d units, %.0f events/sec"%(count,units,rate))
+
+def benchDecode(count=1000000):
+    events=syntheticStream(count)
+    print("decode: %d events, %.0f events/sec"%(count,pumpRate(makeSurface(),events)))
+    xt=makeSurface(metrics=Metrics(enabled=True))
+    rate=pumpRate(xt,events)
+    handler=xt.handlerDuration.snapshot()
+    print("decode: %.0f events/sec with metrics on, handlers p50 %dus p99 %dus"%(rate,handler["p50"],handler["p99"]))
+
+class EosStandIn(object):   #Plays the console on localhost: logs every OSC message with its arrival time, echoes fader moves and answers pings
+    def __init__(self,echo=True,bankDelay=None):
+        self.sock=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1",0))
+        self.sock.settimeout(.05)
+        self.port=self.sock.getsockname()[1]
+        self.echo=echo
+        self.bankDelay=bankDelay    #With a delay, answers the fader bank config with the page's levels that much later, as Eos does over a busy network
+        self.reply=None
+        self.received=[]        #(arrival,address,params)
+        self.packets=0
+        self.bytes=0
+        self.outbox=queue.Queue()   #(due,address,params) for delayed replies, sent in the order they were queued
+        self.running=False
+        self.thread=None
+        self.replyThread=None
+
+    def start(self,replyPort):
+        self.reply=udp_client.SimpleUDPClient("127.0.0.1",replyPort)
+        self.running=True
+        self.thread=threading.Thread(target=self.run,name="Eos stand-in",daemon=True)
+        self.thread.start()
+        self.replyThread=threading.Thread(target=self.sendReplies,name="Eos stand-in replies",daemon=True)
+        self.replyThread.start()
+
+    def stop(self):
+        self.running=False
+        self.thread.join()
+        self.outbox.put(None)
+        self.replyThread.join()
+        self.sock.close()
+
+    def run(self):
+        while self.running:
+            try:
+                dgram=self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            arrival=time.monotonic()
+            self.packets+=1
+            self.bytes+=len(dgram)
+            for timed in osc_packet.OscPacket(dgram).messages:
+                message=timed.message
+                self.received.append((arrival,message.address,message.params))
+                if message.address=="/eos/ping": self.answer(arrival,"/eos/out/ping",message.params)     #Eos echoes the ping's arguments
+                elif self.echo and message.address.startswith("/eos/fader/1/") and message.address.count("/")==4:
+                    self.reply.send_message(message.address,message.params)    #Eos reports the new level back, as it does for any fader move
+                elif self.bankDelay is not None and message.address.startswith("/eos/fader/1/config/"):
+                    (page,count)=[int(part) for part in message.address.split("/")[-2:]]
+                    for fader in range(1,count+1): self.answer(arrival,"/eos/fader/1/%d"%fader,bankLevel(page,fader))
+
+    def answer(self,arrival,address,params):    #With a bank delay every answer is held back by it, so they still arrive in the order Eos sent them
+        if self.bankDelay is None: self.reply.send_message(address,params)
+        else: self.outbox.put((arrival+self.bankDelay,address,params))
+
+    def sendReplies(self):
+        while True:
+            entry=self.outbox.get()
+            if entry is None: return
+            (due,address,params)=entry
+            wait=due-time.monotonic()
+            if wait>0: time.sleep(wait)
+            self.reply.send_message(address,params)
+
+    def messages(self,prefix):
+        return [entry for entry in self.received if entry[1].startswith(prefix)]
+
+def bankLevel(page,fader):  #A distinct level for every fader on every page, so a motor move shows which page it came from
+    return ((page*8+fader)*37%100)/100.0
+
+def freePort():
+    sock=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1",0))
+    port=sock.getsockname()[1]
+    sock.close()
+    return port
+
+class Rig(object):      #EOS_Automation.py's profile-driven wiring, between replayed MIDI and the Eos stand-in
+    def __init__(self,captures,echo=True,profile=PROFILE,bankDelay=None):
+        self.xt=makeSurface(captures)
+        self.standIn=EosStandIn(echo,bankDelay)
+        self.serverPort=freePort()
+        self.e=eos.eos("127.0.0.1",self.standIn.port,"127.0.0.1",self.serverPort,scheduler=self.xt.scheduler)
+        self.e.attachSurface(self.xt)
+        self.mapper=Mapper(self.xt,self.e,profile,watch=False)
+        self.xt.scheduler.runDue()      #Get the profile's labels painted before anything is measured
+
+    def run(self,seconds):
+        self.standIn.start(self.serverPort)
+        server=threading.Thread(target=self.e.start,name="Eos server",daemon=True)
+        server.start()
+        self.xt.start()
+        time.sleep(seconds)
+        while self.xt.midiReader.queued() or any([midiIn.events for midiIn in self.xt.backend.inputs]): time.sleep(.01)
+        time.sleep(.2)      #Let the last coalesced values and their echoes land
+        self.xt.stop()
+        while self.e.server is None: time.sleep(.01)
+        self.e.server.shutdown()
+        self.standIn.stop()
+
+def captureLength(captures):
+    return max([capture[-1][1] for capture in captures if capture])/1000.0
+
+def faderSweepStream(fader,seconds=2.0,rate=250):    #Hand-speed sweep from bottom to top, touch to release; every level is distinct so arrivals can be matched to the event that caused them
+    steps=int(seconds*rate)
+    events=[[[0x90,104+fader,127,0],REPLAY_LEAD_IN-10]]
+    for i in range(steps):
+        level=16256*i//(steps-1)
+        events.append([[0xe0+fader,level%128,level//128,0],REPLAY_LEAD_IN+int(i*1000/rate)])
+    events.append([[0x90,104+fader,0,0],REPLAY_LEAD_IN+int(steps*1000/rate)])
+    return events
+
+def benchSweep(units=1,seconds=2.0):     #Every fader swept at once; latency runs from the event's timestamp to its OSC message reaching "Eos"
+    captures=[]
+    for unit in range(units):
+        capture=[]
+        for fader in range(8): capture.extend(faderSweepStream(fader,seconds))
+        capture.sort(key=lambda event:event[1])
+        captures.append(capture)
+    rate=pumpRate(makeSurface(),[[msg,0] for capture in captures for (msg,timestamp) in capture])
+    rig=Rig(captures)
+    rig.run(captureLength(captures))
+    sent={}
+    for unit in range(units):
+        for (msg,timestamp) in captures[unit]:
+            if msg[0]>=0xe0: sent[(8*unit+msg[0]-0xe0,(msg[2]<<7)|msg[1])]=rig.xt.backend.due(timestamp)     #The level XTouch.faderLevelHandler reports
+    latency=Histogram("ms")
+    for (arrival,address,params) in rig.standIn.messages("/eos/fader/1/"):
+        if address.count("/")!=4: continue      #The fader bank config
+        key=(int(address.split("/")[-1])-1,round(params[0]*16256))
+        if key in sent: latency.record(1000*(arrival-sent[key]))
+    snap=latency.snapshot()
+    events=sum([len(capture) for capture in captures])
+    print("sweep: %d units, %d events, %.0f events/sec through the pump"%(units,events,rate))
+    print("sweep: %d fader messages to Eos, latency p50 %.1fms p90 %.1fms p99 %.1fms max %.1fms"%(snap["count"],snap["p50"],snap["p90"],snap["p99"],snap["max"]))
+    print("sweep: %d bytes on the MIDI wire from Eos echoes, %d OSC packets"%(wireBytes(rig.xt),rig.standIn.packets))
+    print("sweep: suppressed %s"%rig.xt.faderStats())
+
+def encoderSpinStream(seconds,eventsPerSecond=200):  #Every encoder spinning flat out, the way the surface delivers it: a few events per millisecond
+    events=[]
+    for i in range(int(seconds*eventsPerSecond)):
+        for ch in range(8):
+            events.append([[0xb0,16+ch,3,0],REPLAY_LEAD_IN+int(i*1000/eventsPerSecond)])
+    return events
+
+def benchSpin(seconds=2.0):
+    events=encoderSpinStream(seconds)
+    rate=pumpRate(makeSurface(),[[msg,0] for (msg,timestamp) in events])
+    rig=Rig([events],echo=False)
+    rig.mapper.setEncoderPage(1)        #A page with a parameter on every encoder
+    before=rig.e.outputStats()
+    rig.run(captureLength([events]))
+    after=rig.e.outputStats()
+    messages=after["messages"]-before["messages"]
+    packets=after["packets"]-before["packets"]
+    ticks=sum([params[0] for (arrival,address,params) in rig.standIn.messages("/eos/wheel/")])
+    print("spin: %d events, %.0f events/sec through the pump"%(len(events),rate))
+    print("spin: %d wheel messages carrying %d ticks in %d packets (%.0f packets/sec, %.1f messages per packet), %d bytes on the MIDI wire"%(messages,ticks,packets,packets/seconds,messages/max(packets,1),wireBytes(rig.xt)))
+
+ENCODER_PAGES=[
+    ["level","pan","tilt","zoom","edge","iris","",""],
+    ["level","red","green","blue","amber","white","hue","saturation"],
+    ["level","cyan","magenta","yellow","cto","ctb","hue","saturation"],
+    ["level","frame thrust a","frame angle a","zoom","edge","iris","",""],
+]
+
+def settle(xt):     #Until the surface has written everything, paced to the wire
+    while xt.devices[0].surface.backlog() or xt.devices[0].surface.flushPending: time.sleep(.005)
+
+def benchScribble():    #Bytes on the MIDI wire to paint the labels and flip through the encoder pages
+    xt=makeSurface()
+    out=xt.midiOut
+    xt.scheduler.start()
+    xt.setTexts(1,["core","color1","color2","shutter","gobo","5","6","7"])
+    xt.setTexts(0,ENCODER_PAGES[0])
+    settle(xt)
+    print("scribble: initial paint %d bytes (%d bytes as one frame per line)"%(out.written,16*15))
+    for page in ENCODER_PAGES[1:]+ENCODER_PAGES[:1]:
+        before=out.written
+        xt.setTexts(0,page)
+        settle(xt)
+        print("scribble: page flip %d bytes (%d bytes as one frame per line)"%(out.written-before,8*15))
+    xt.scheduler.stop()
+
+def benchOutput(flips=20,interval=.01):    #Page flips faster than the wire can carry them while Eos moves a fader: the motor shouldn't wait behind the text
+    xt=makeSurface()
+    out=xt.midiOut
+    out.keep=True
+    xt.scheduler.start()
+    waits=Histogram("ms")
+    backlog=0
+    moves=[]
+    start=time.monotonic()
+    for i in range(flips):
+        xt.setTexts(0,ENCODER_PAGES[i%len(ENCODER_PAGES)])
+        xt.setTexts(1,ENCODER_PAGES[(i+1)%len(ENCODER_PAGES)])
+        moved=xt.midiClock()
+        xt.setFader(0,1000+500*i)
+        moves.append(moved)
+        time.sleep(interval)
+        backlog=max(backlog,xt.devices[0].surface.backlog())
+    settle(xt)
+    for moved in moves: waits.record(min([timestamp for (timestamp,msg) in out.log if msg[0]==0xe0 and timestamp>=moved])-moved)
+    elapsed=time.monotonic()-start
+    xt.scheduler.stop()
+    snap=waits.snapshot()
+    print("output: %d bytes in %.0fms (%.0f bytes/sec, the wire carries %d), peak backlog %d bytes"%(out.written,1000*elapsed,out.written/elapsed,xt.devices[0].surface.rate,backlog))
+    print("output: fader moves waited p50 %.0fms max %.0fms behind the text, %s"%(snap["p50"],snap["max"],xt.outputStats()))
+
+def pageFlipStream(flips,interval=50):  #Mashing the encoder page buttons, as the profile binds them
+    events=[]
+    for i in range(flips):
+        timestamp=REPLAY_LEAD_IN+i*interval
+        events.append([[0x90,i%len(ENCODER_PAGES),127,0],timestamp])
+        events.append([[0x90,i%len(ENCODER_PAGES),0,0],timestamp+10])
+    return events
+
+def benchPages(flips=40):
+    events=pageFlipStream(flips)
+    rig=Rig([events],echo=False)
+    before=wireBytes(rig.xt)
+    rig.run(captureLength([events]))
+    written=wireBytes(rig.xt)-before
+    print("pages: %d page flips, %d bytes on the MIDI wire, %.1f bytes per flip (%d as one frame per line)"%(flips,written,written/flips,8*15))
+
+def faderPageStream(flips,interval=300):    #Stepping through the fader pages with channel 8's third button, waiting for the motors between presses
+    events=[]
+    for i in range(flips):
+        timestamp=REPLAY_LEAD_IN+i*interval
+        events.append([[0x90,31,127,0],timestamp])
+        events.append([[0x90,31,0,0],timestamp+10])
+    return events
+
+def benchFaderPages(laps=2,delay=0.08,fastInterval=30):    #Time from a fader page press until the motors move, first lap from Eos, later laps from the mirror; then a lap flipped faster than Eos answers
+    rig=Rig([[]],echo=False,bankDelay=delay)
+    pages=rig.mapper.compiled.faderPages
+    events=faderPageStream(laps*pages)
+    fastStart=events[-1][1]+300
+    for (msg,timestamp) in faderPageStream(pages,fastInterval): events.append([msg,timestamp-REPLAY_LEAD_IN+fastStart])
+    rig.xt.backend.inputs[0].feed(events)
+    rig.xt.backend.outputs[0].keep=True
+    rig.run(captureLength([events]))
+    moves=[timestamp for (timestamp,msg) in rig.xt.backend.outputs[0].log if msg[0]>=0xe0]
+    for lap in range(laps):
+        waits=Histogram("ms")
+        for (msg,pressed) in events[2*lap*pages:2*(lap+1)*pages:2]:
+            after=[timestamp for timestamp in moves if timestamp>=pressed]
+            if after: waits.record(after[0]-pressed)
+        snap=waits.snapshot()
+        print("faderpages: lap %d, %d of %d pages moved the motors, p50 %.0fms max %.0fms after the press (Eos answers after %.0fms)"%(lap+1,snap["count"],pages,snap["p50"],snap["max"],1000*delay))
+    cached=dict(rig.e.mirror.levels)
+    wrong=[page for (page,levels) in cached.items() if any([abs(level-100*bankLevel(page,fader))>0.01 for (fader,level) in levels.items()])]
+    print("faderpages: after a lap %dms apart, %d of %d cached pages hold another page's levels"%(fastInterval,len(wrong),len(cached)))
+    print("faderpages: mirror %s"%rig.e.mirror.stats())
+
+def pressStream(taps,interval=60,hold=1.2):    #Every knob push and button on a unit tapped taps times in a row, then all held down together
+    events=[]
+    notes=list(range(32))+list(range(32,40))
+    for i in range(taps):
+        timestamp=REPLAY_LEAD_IN+i*interval
+        for note in notes:
+            events.append([[0x90,note,127,0],timestamp])
+            events.append([[0x90,note,0,0],timestamp+20])
+    held=REPLAY_LEAD_IN+taps*interval+500
+    for note in notes:
+        events.append([[0x90,note,127,0],held])
+        events.append([[0x90,note,0,0],held+int(1000*hold)])
+    events.sort(key=lambda event:event[1])
+    return (events,held)
+
+def benchGestures(units=4,taps=3):     #Taps, triple presses and holds on every press source of four units: scheduler jobs per press and how late the holds fire
+    (events,heldAt)=pressStream(taps)
+    captures=[events for unit in range(units)]
+    xt=makeSurface(captures)
+    counts={}
+    held=[]
+    def count(gesture):
+        return lambda arg:counts.__setitem__(gesture,counts.get(gesture,0)+1)
+    for kind in ["Knob"]+["Button%s"%number for number in range(4)]:
+        suffix="" if kind=="Knob" else kind[-1]
+        prefix=kind.rstrip("0123456789")
+        xt.bind(prefix+"DoublePress"+suffix,count("double"))
+        xt.bind(prefix+"TriplePress"+suffix,count("triple"))
+        xt.bind(prefix+"PressAndHold"+suffix,lambda arg:held.append(time.monotonic()))
+    scheduled=xt.scheduler.seq
+    xt.start()
+    time.sleep(captureLength(captures)+.1)
+    xt.stop()
+    presses=xt.gestures.presses
+    due=xt.backend.due(heldAt)+xt.gestures.holdTime[0]     #Everything went down together, so every hold is due at the same moment
+    late=Histogram("ms")
+    for fired in held: late.record(1000*(fired-due))
+    snap=late.snapshot()
+    print("gestures: %d units, %d presses, %d scheduler jobs (%.2f per press), %s"%(units,presses,xt.scheduler.seq-scheduled,(xt.scheduler.seq-scheduled)/presses,counts))
+    print("gestures: %d holds fired p50 %.1fms max %.1fms after they were due, %s"%(snap["count"],snap["p50"],snap["max"],xt.gestures.stats()))
+
+def benchMeters(seconds=2.0,rate=1000):     #Every meter fed a bouncing level at rate samples/sec, as a level stream from Eos might
+    xt=makeSurface()
+    xt.scheduler.start()
+    samples=0
+    start=time.monotonic()
+    while time.monotonic()-start<seconds:
+        t=time.monotonic()-start
+        for meter in range(8): xt.feedMeter(meter,int(13*abs(((t*(meter+1))%2)-1)))
+        samples+=8
+        time.sleep(1.0/rate)
+    time.sleep(1.5)     #Long enough for the peaks to fall and the engine to go quiet
+    xt.scheduler.stop()
+    print("meters: %d samples fed, %d bytes on the MIDI wire (%d sending every sample), %s"%(samples,wireBytes(xt),2*samples,xt.meters.stats()))
+
+def benchReconnect(units=2,outage=3.0):    #Pull one unit's cable mid-show and plug it back in: time until it's showing everything again, and what the others saw meanwhile
+    xt=makeSurface([[] for unit in range(units)])
+    backend=xt.backend
+    xt.start()
+    for unit in range(units):
+        xt.setTexts(1,["core","color1","color2","shutter","gobo","5","6","7"],8*unit)
+        xt.setTexts(0,ENCODER_PAGES[unit%len(ENCODER_PAGES)],8*unit)
+        for fader in range(8): xt.setFader(8*unit+fader,2000*fader)
+        xt.channel[8*unit].button[0].led.blink(1)
+    time.sleep(.1)
+    lost=units-1
+    xt.channel[0].fader.touch()     #A hand on a healthy unit's fader all through the outage
+    healthy=backend.outputs[0].written
+    backend.unplug(lost)
+    xt.setTexts(0,ENCODER_PAGES[1],8*lost)      #Changed while it's gone; the repaint has to show it
+    time.sleep(outage)
+    backend.replug(lost)
+    replugged=time.monotonic()
+    before=backend.outputs[lost].written
+    while xt.deviceStats()["connected"]<units and time.monotonic()-replugged<5: time.sleep(.001)
+    reopened=time.monotonic()
+    while backend.outputs[lost].messages==0 and time.monotonic()-replugged<5: time.sleep(.001)
+    painted=time.monotonic()
+    time.sleep(.1)
+    xt.stop()
+    print("reconnect: unit %d of %d showing everything %.0fms after replug (reopened after %.0fms, repainted %.1fms later), %d bytes in %d messages, %s"%(lost+1,units,1000*(painted-replugged),1000*(reopened-replugged),1000*(painted-reopened),backend.outputs[lost].written-before,backend.outputs[lost].messages,xt.deviceStats()))
+    print("reconnect: %.1fs outage took %d rescans, %d bytes went to the unit that stayed, its touched fader is %s"%(outage,backend.rescans,backend.outputs[0].written-healthy,xt.channel[0].fader.state))
+
+BENCHMARKS={"decode":benchDecode,"controls":benchControls,"gestures":benchGestures,"sweep":benchSweep,"spin":benchSpin,"pages":benchPages,"faderpages":benchFaderPages,"scribble":benchScribble,"output":benchOutput,"meters":benchMeters,"reconnect":benchReconnect}
+
+if __name__=="__main__":
+    names=sys.argv[1:] or list(BENCHMARKS)
+    for name in names: BENCHMARKS[name]()
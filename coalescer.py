@@ -0,0 +1,48 @@
+import threading
+import time
+
+class Coalescer(object):        #Keeps only the latest value per key and flushes at most maxRate times a second
+    def __init__(self,scheduler,send,maxRate=60,latency=None):
+        self.scheduler=scheduler
+        self.send=send              #Called as send(key,value) from the scheduler thread
+        self.interval=1.0/maxRate
+        self.pending={}
+        self.latency=latency        #Optional metrics Histogram: microseconds from the first put of a value to it being sent
+        self.since={}
+        self.lock=threading.Lock()
+        self.job=None
+        self.lastFlush=0.0
+        self.sent=0
+        self.dropped=0
+
+    def setMaxRate(self,maxRate):     #Takes effect from the next slot
+        with self.lock: self.interval=1.0/maxRate
+
+    def put(self,key,value):
+        with self.lock:
+            if key in self.pending: self.dropped+=1     #Superseded before it ever went out
+            elif self.latency is not None: self.since[key]=time.perf_counter()
+            self.pending[key]=value
+            if self.job is None:    #The first move after a quiet spell goes straight out, later ones wait for the next slot
+                delay=self.lastFlush+self.interval-time.monotonic()
+                self.job=self.scheduler.after(max(delay,0),self.flush)
+
+    def flush(self):
+        with self.lock:
+            pending=self.pending
+            self.pending={}
+            since=self.since
+            self.since={}
+            self.job=None
+            self.lastFlush=time.monotonic()
+        for key in pending:
+            self.send(key,pending[key])
+            if key in since: self.latency.record((time.perf_counter()-since[key])*1000000)
+        self.sent+=len(pending)
+
+    def stats(self):
+        retval={}
+        retval["sent"]=self.sent
+        retval["dropped"]=self.dropped
+        retval["pending"]=len(self.pending)
+        return retval
@@ -1,35 +1,440 @@
 from pythonosc import dispatcher
 from pythonosc import osc_server
-from pythonosc import udp_client
+import asyncio
+import collections
+import functools
+import logging
+import socket
+import struct
+import threading
+import time
+
+MAX_BUNDLE_SIZE=1400    #Stay under a typical Ethernet MTU so bundles are never fragmented
+OUTPUT_FLUSH_PERIOD=0.01  #Messages sent within this window of each other share a bundle
+BUNDLE_HEADER=b"#bundle\x00"+struct.pack(">Q",1)   #Timetag 1 means "immediately"
+MAX_ROUTE_CACHE=4096    #Concrete addresses remembered by OscRouter before it starts over
+INT_SEGMENT="#"         #Route segment that matches any integer and passes it to the handler
+KEEPALIVE_PERIOD=5.0    #Seconds between pings to Eos while we want any feed, the fader bank included
+KEEPALIVE_MISSES=3      #Unanswered pings before we assume Eos has forgotten us and ask for everything again
+MIRROR_PAGES=16         #Fader pages the mirror remembers; the one shown least recently is dropped first
+FADER_BANK_INDEX=1      #The fader bank we configure and talk to, the 1 in /eos/fader/1/...
+BANK_MARK="bank"        #Ping argument sent ahead of each bank config; Eos echoes it once it has sent everything about the old page
+BANK_CONFIRM_TIMEOUT=0.5    #Seconds after a bank config before fader reports count as the new page's even without the echo
+FADER_BANK="faders"     #Feed name for the fader bank, which Eos configures separately from /eos/out
+HANDLER_FEEDS={         #What each bound handler, from eos.bindHandler or XTouch.bind, needs Eos to send us
+    "FaderLevel":(FADER_BANK,),
+    "FaderPress":(FADER_BANK,),
+    "FaderRelease":(FADER_BANK,),
+    "WheelInfo":("/eos/out/active/wheel/*",),
+    "ActiveChannel":("/eos/out/active/chan",),
+}
+
+log=logging.getLogger("eos")
+
+def oscString(s):
+    b=s.encode("utf8")+b"\x00"
+    return b+b"\x00"*(-len(b)%4)
+
+class OscRouter(dispatcher.Dispatcher):     #Prefix trie over address segments, resolved once per concrete address and cached
+    def __init__(self):
+        dispatcher.Dispatcher.__init__(self)
+        self.root={}
+        self.cache={}
+        self.counts={}
+        self.dropped=0
+        self.received=0
+
+    def route(self,pattern,handler):    #handler(*intSegments,address,*oscArgs)
+        node=self.root
+        for segment in pattern.strip("/").split("/"):
+            node=node.setdefault(segment,{})
+        node[None]=pattern
+        node[pattern]=handler
+        self.counts[pattern]=0
+        self.cache={}
+
+    def resolve(self,address):
+        node=self.root
+        ints=[]
+        for segment in address.strip("/").split("/"):
+            child=node.get(segment)
+            if child is None:
+                child=node.get(INT_SEGMENT)
+                if child is None or not segment.isdigit(): return None   #Nothing under this prefix, so bail out early
+                ints.append(int(segment))
+            node=child
+        pattern=node.get(None)
+        if pattern is None: return None
+        return (pattern,dispatcher.Handler(functools.partial(node[pattern],*ints),[]))
+
+    def lookup(self,address):
+        try:
+            return self.cache[address]
+        except KeyError:
+            if len(self.cache)>=MAX_ROUTE_CACHE: self.cache={}
+            entry=self.cache[address]=self.resolve(address)
+            return entry
+
+    def routes(self):
+        return list(self.counts)
+
+    def handlers_for_address(self,address_pattern):
+        entry=self.lookup(address_pattern)
+        if entry is None:
+            self.dropped+=1
+            return []
+        self.counts[entry[0]]+=1
+        return [entry[1]]
+
+    def unrouted(self,data):    #Drop plain messages nobody wants before pythonosc parses their arguments
+        self.received+=1
+        if data[:1]!=b"/": return False     #Bundles get unpacked and routed message by message
+        end=data.find(b"\x00")
+        if end<0 or self.lookup(data[:end].decode("utf8","replace")) is not None: return False
+        self.dropped+=1
+        return True
+
+    def call_handlers_for_packet(self,data,client_address):
+        if self.unrouted(data): return []
+        return dispatcher.Dispatcher.call_handlers_for_packet(self,data,client_address)
+
+    async def async_call_handlers_for_packet(self,data,client_address):
+        if self.unrouted(data): return []
+        return await dispatcher.Dispatcher.async_call_handlers_for_packet(self,data,client_address)
+
+    def stats(self):
+        retval=dict(self.counts)
+        retval["received"]=self.received
+        retval["dropped"]=self.dropped
+        retval["cached"]=len(self.cache)
+        return retval
+
+class Subscriptions(object):    #Keeps Eos streaming only the feeds our bound handlers actually need
+    def __init__(self,console):
+        self.console=console
+        self.sources={}         #Who asked -> set of handler names
+        self.filters=set()      #/eos/out patterns Eos has been asked to send
+        self.subscribed=False
+        self.faderBank=False
+        self.faderPage=1
+        self.faderCount=8       #One fader per surface channel, so 8 per extender
+        self.keepalive=None
+        self.missedPings=0
+        self.bankGeneration=0
+        self.pendingBanks={}    #Bank configs whose echo hasn't come back: generation -> page
+        self.confirmedPage=None #Page the fader reports arriving now are about
+        self.configTime=0.0
+        self.pingEcho=False     #Eos has echoed a bank mark, so reports before the echo can be told apart from the answer
+        self.bankLock=threading.Lock()  #The bank state above is shared with the OSC server's threads when it isn't running on asyncio
+
+    def declare(self,source,names):
+        self.sources[source]=set(names)
+        self.update()
+
+    def wanted(self):
+        feeds=set()
+        for names in self.sources.values():
+            for name in names: feeds.update(HANDLER_FEEDS.get(name,()))
+        return feeds
+
+    def update(self,force=False):
+        feeds=self.wanted()
+        filters=feeds-{FADER_BANK}
+        if force or filters!=self.filters:
+            if force or self.filters: self.console.send("/eos/filter/clear")
+            if filters: self.console.send("/eos/filter/add",sorted(filters|{"/eos/out/ping"}))
+            self.filters=filters
+        subscribe=bool(filters)
+        if force or subscribe!=self.subscribed:
+            self.console.send("/eos/subscribe",1 if subscribe else 0)
+            self.subscribed=subscribe
+        faderBank=FADER_BANK in feeds
+        if faderBank and (force or not self.faderBank): self.sendFaderConfig()
+        self.faderBank=faderBank
+        self.updateKeepalive()
+
+    def setFaderPage(self,page):
+        self.faderPage=page
+        if self.faderBank: self.sendFaderConfig()
+
+    def setFaderCount(self,count):     #A bank Eos already configured has to be configured again at the new size
+        if count==self.faderCount: return
+        self.faderCount=count
+        if self.faderBank: self.sendFaderConfig()
+
+    def sendFaderConfig(self):
+        with self.bankLock:
+            self.bankGeneration+=1
+            generation=self.bankGeneration
+            page=self.faderPage
+            self.pendingBanks[generation]=page
+            self.configTime=time.monotonic()
+        self.console.send("/eos/ping","{}{}".format(BANK_MARK,generation))   #Same bundle, so Eos handles it just before the config
+        self.console.send("/eos/fader/{}/config/{}/{}".format(FADER_BANK_INDEX,page,self.faderCount))
+
+    def bankReport(self):   #(page the fader reports arriving now belong to or None while that can't be told, False while they can only be about a page we've since left)
+        with self.bankLock:
+            pending=self.pendingBanks
+            if pending and time.monotonic()-self.configTime>BANK_CONFIRM_TIMEOUT:     #Echo lost, or a console that doesn't echo
+                self.confirmedPage=pending[max(pending)]
+                pending.clear()
+            if pending and not self.pingEcho: return (None,True)
+            return (self.confirmedPage,not (pending and self.pingEcho))
+
+    def updateKeepalive(self):
+        scheduler=self.console.scheduler
+        if scheduler is None: return
+        active=self.subscribed or self.faderBank    #The fader bank alone still has to be configured again if Eos restarts
+        if active and self.keepalive is None:
+            self.missedPings=0
+            self.keepalive=scheduler.every(KEEPALIVE_PERIOD,self.ping)
+        elif not active and self.keepalive is not None:
+            self.keepalive.cancel()
+            self.keepalive=None
+
+    def ping(self):
+        self.missedPings+=1
+        if self.missedPings>KEEPALIVE_MISSES:   #Eos restarted or dropped us: ask for everything again
+            self.missedPings=0
+            self.update(force=True)
+        self.console.send("/eos/ping")
+
+    def pong(self,addr,*args):
+        self.missedPings=0
+        if not args or not str(args[0]).startswith(BANK_MARK): return
+        try:
+            generation=int(str(args[0])[len(BANK_MARK):])
+        except ValueError:
+            return
+        with self.bankLock:
+            page=self.pendingBanks.get(generation)
+            if page is None: return
+            self.pingEcho=True
+            self.confirmedPage=page     #Everything from here on answers this config, until the next echo
+            for pending in list(self.pendingBanks):
+                if pending<=generation: del self.pendingBanks[pending]
+
+class Mirror(object):     #The last fader levels and names Eos reported for each page, and wheel parameter values, so a page can be shown before Eos answers
+    def __init__(self,maxPages=MIRROR_PAGES):
+        self.maxPages=maxPages
+        self.lock=threading.Lock()
+        self.levels=collections.OrderedDict()   #page -> {fader:level}, least recently shown first
+        self.names={}                           #page -> {fader:name}, dropped along with the page's levels
+        self.parameters={}                      #Lower-cased wheel parameter name -> value
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def faderLevel(self,page,fader,level):
+        with self.lock:
+            levels=self.levels.get(page)
+            if levels is None:
+                levels=self.levels[page]={}
+                while len(self.levels)>self.maxPages:
+                    (evicted,dropped)=self.levels.popitem(last=False)
+                    self.names.pop(evicted,None)
+                    self.evictions+=1
+            levels[fader]=level
+
+    def faderName(self,page,fader,name):
+        with self.lock:
+            if page in self.levels: self.names.setdefault(page,{})[fader]=name
+
+    def page(self,page):        #{fader:level} last seen on page, or None if it isn't cached; counts as a use for eviction
+        with self.lock:
+            levels=self.levels.get(page)
+            if levels is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            self.levels.move_to_end(page)
+            return dict(levels)
+
+    def pageNames(self,page):
+        with self.lock:
+            return dict(self.names.get(page,{}))
+
+    def wheel(self,label,value):   #label as Eos shows it, e.g. "Pan [ 12.00]"
+        name=label.split("[")[0].strip().lower()
+        with self.lock:
+            self.parameters[name]=value
+        return name
+
+    def parameter(self,name):
+        return self.parameters.get(name.lower())
+
+    def stats(self):
+        retval={}
+        retval["pages"]=len(self.levels)
+        retval["hits"]=self.hits
+        retval["misses"]=self.misses
+        retval["evictions"]=self.evictions
+        retval["parameters"]=len(self.parameters)
+        return retval
 
 class eos ():
-    def __init__(self,clientIp,clientPort,serverIp,serverPort):
+    def __init__(self,clientIp,clientPort,serverIp,serverPort,scheduler=None,maxBundleSize=MAX_BUNDLE_SIZE,flushPeriod=OUTPUT_FLUSH_PERIOD):
         self.boundHandlers={}
-        self.dispatcher = dispatcher.Dispatcher()
-        self.dispatcher.map("/eos*", self.defaultEosHandler)
-        self.dispatcher.map("/eos/fader*", self.oscFaderHandler)
-        self.client = udp_client.SimpleUDPClient(clientIp,clientPort)
-        self.server = osc_server.ThreadingOSCUDPServer((serverIp,serverPort), self.dispatcher)
-        self.client.send_message("/eos/subscribe",1)
-        self.client.send_message("/eos/fader/1/config/8",None)
+        self.dispatcher = OscRouter()
+        self.dispatcher.route("/eos/fader/#/#", self.oscFaderHandler)
+        self.dispatcher.route("/eos/fader/#/#/name", self.oscFaderNameHandler)
+        self.dispatcher.route("/eos/out/active/wheel/#", self.oscWheelHandler)
+        self.mirror=Mirror()
+        self.subscriptions=Subscriptions(self)
+        self.dispatcher.route("/eos/out/ping", self.subscriptions.pong)
+        self.serverAddress=(serverIp,serverPort)
+        self.server=None            #Created by start() or serveAsync(), so only one of them binds the port
+        self.scheduler=scheduler    #With a scheduler, everything sent during one tick goes out as a single bundle
+        self.maxBundleSize=maxBundleSize
+        self.flushPeriod=flushPeriod
+        self.lastFlush=0.0
+        self.eosAddress=(clientIp,clientPort)
+        self.sock=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.addressCache={}
+        self.outLock=threading.Lock()
+        self.outQueue=[]
+        self.flushPending=False
+        self.messagesSent=0
+        self.packetsSent=0
+        self.bundlesSent=0
+        self.bytesSent=0
+        self.receiveMark=(time.monotonic(),0)
+        self.subscriptions.update(force=True)
 
     def start(self):
+        self.server = osc_server.ThreadingOSCUDPServer(self.serverAddress, self.dispatcher)
         self.server.serve_forever()
 
-    def defaultEosHandler(self, addr, *args):
-#        print("[{}] {}".format(addr,args))
-        return
-    def oscFaderHandler(self, addr, *args):
-        (page,fader)=addr.split("/")[3:5]
-        page=int(page)
-        fader=int(fader)
+    async def serveAsync(self):     #Handlers run on the calling loop, no thread per datagram; returns the transport to close
+        self.server=osc_server.AsyncIOOSCUDPServer(self.serverAddress,self.dispatcher,asyncio.get_running_loop())
+        (transport,protocol)=await self.server.create_serve_endpoint()
+        return transport
+
+    def oscFaderHandler(self, page, fader, addr, *args):
         level=100*float(args[0])
 #        print("Page {} Fader {} is at {:.1f}".format(page,fader,level))
+        (bankPage,current)=self.subscriptions.bankReport()
+        if bankPage is not None: self.mirror.faderLevel(bankPage,fader,level)
+        if not current: return      #The old page's levels, still in flight when we flipped
         if "FaderLevel" in self.boundHandlers:self.boundHandlers["FaderLevel"](page,fader,level)
+    def oscFaderNameHandler(self, page, fader, addr, *args):
+        (bankPage,current)=self.subscriptions.bankReport()
+        if args and bankPage is not None: self.mirror.faderName(bankPage,fader,str(args[0]))
+    def oscWheelHandler(self, wheel, addr, *args):     #"Pan [ 12.00]", category, value
+        if len(args)<3: return
+        name=self.mirror.wheel(str(args[0]),float(args[2]))
+        if "WheelInfo" in self.boundHandlers:self.boundHandlers["WheelInfo"](wheel,name,float(args[2]))
 
     def bindHandler(self,name,handler):
-        print("Eos binding handler {}".format(name))
+        log.info("Eos binding handler %s",name)
         self.boundHandlers[name]=handler
+        self.subscriptions.declare(self,self.boundHandlers)
 
-    def setFaderPage(self,page):
-        self.client.send_message("/eos/fader/1/config/{}/8".format(page),None)
\ No newline at end of file
+    def attachSurface(self,xt):     #Subscribe to whatever the surface's bound handlers need, now and whenever it rebinds
+        self.subscriptions.setFaderCount(len(xt.channel))
+        xt.metrics.gauge("oscRoutes",self.routeStats)      #Report alongside the surface's own metrics
+        xt.metrics.gauge("oscReceiveRate",self.receiveRate)
+        xt.metrics.gauge("oscOutput",self.outputStats)
+        xt.metrics.gauge("oscOutQueue",lambda:len(self.outQueue))
+        xt.metrics.gauge("oscMirror",self.mirror.stats)
+        xt.bindListeners.append(self.surfaceBound)
+        self.surfaceBound(xt)
+
+    def surfaceBound(self,xt):
+        self.subscriptions.declare(xt,xt.boundEventNames())
+
+    def setFaderPage(self,page):    #Shows the page from the mirror straight away; Eos's own report of it follows and corrects anything stale
+        self.subscriptions.setFaderPage(page)
+        levels=self.mirror.page(page)
+        handler=self.boundHandlers.get("FaderLevel")
+        if levels is None or handler is None: return
+        for fader in sorted(levels): handler(FADER_BANK_INDEX,fader,levels[fader])
+
+    def encodeMessage(self,address,value=None):
+        encodedAddress=self.addressCache.get(address)
+        if encodedAddress is None:
+            encodedAddress=self.addressCache[address]=oscString(address)
+        if value is None: values=()
+        elif isinstance(value,(list,tuple)): values=value
+        else: values=(value,)
+        tags=","
+        data=b""
+        for v in values:
+            if isinstance(v,float):
+                tags+="f"
+                data+=struct.pack(">f",v)
+            elif isinstance(v,bool):
+                tags+="T" if v else "F"
+            elif isinstance(v,int):
+                tags+="i"
+                data+=struct.pack(">i",v)
+            else:
+                tags+="s"
+                data+=oscString(str(v))
+        return encodedAddress+oscString(tags)+data
+
+    def send(self,address,value=None):
+        message=self.encodeMessage(address,value)
+        if self.scheduler is None:
+            self.sendPacket(message)
+            self.messagesSent+=1
+            return
+        with self.outLock:
+            self.outQueue.append(message)
+            if not self.flushPending:   #The first message after a quiet spell goes out on the next tick, the rest wait for the following window
+                self.flushPending=True
+                delay=self.lastFlush+self.flushPeriod-time.monotonic()
+                self.scheduler.after(max(delay,0),self.flushOutput)
+
+    def flushOutput(self):
+        with self.outLock:
+            queue=self.outQueue
+            self.outQueue=[]
+            self.flushPending=False
+            self.lastFlush=time.monotonic()
+        self.messagesSent+=len(queue)
+        if len(queue)==1:
+            self.sendPacket(queue[0])
+            return
+        bundle=[]
+        size=len(BUNDLE_HEADER)
+        for message in queue:
+            if bundle and size+4+len(message)>self.maxBundleSize:
+                self.sendBundle(bundle)
+                bundle=[]
+                size=len(BUNDLE_HEADER)
+            bundle.append(message)
+            size+=4+len(message)
+        if bundle: self.sendBundle(bundle)
+
+    def sendBundle(self,messages):
+        if len(messages)==1:
+            self.sendPacket(messages[0])
+            return
+        packet=BUNDLE_HEADER+b"".join([struct.pack(">i",len(m))+m for m in messages])
+        self.bundlesSent+=1
+        self.sendPacket(packet)
+
+    def sendPacket(self,packet):
+        self.sock.sendto(packet,self.eosAddress)
+        self.packetsSent+=1
+        self.bytesSent+=len(packet)
+
+    def routeStats(self):
+        return self.dispatcher.stats()
+
+    def receiveRate(self):      #Packets per second received since the last call
+        now=time.monotonic()
+        received=self.dispatcher.received
+        (then,before)=self.receiveMark
+        self.receiveMark=(now,received)
+        return (received-before)/(now-then) if now>then else 0.0
+
+    def outputStats(self):
+        retval={}
+        retval["messages"]=self.messagesSent
+        retval["packets"]=self.packetsSent
+        retval["bundles"]=self.bundlesSent
+        retval["bytes"]=self.bytesSent
+        retval["queued"]=len(self.outQueue)
+        return retval
@@ -0,0 +1,122 @@
+import array
+import heapq
+import time
+
+SOURCES_PER_CHANNEL=5   #The knob push and the four buttons
+MAX_TAPS=3              #Triple press is the longest run counted; the next tap starts again at one
+
+class Chord(object):
+    __slots__=("sources","handler","event","fired")
+
+    def __init__(self,sources,handler,event):
+        self.sources=sources
+        self.handler=handler
+        self.event=event
+        self.fired=0
+
+class GestureRecognizer(object):    #Every press source in flat tables, holds timed from one deadline heap behind a single scheduler job
+    def __init__(self,scheduler,sources,holdTime,multiTime):
+        self.scheduler=scheduler
+        self.targets=[None]*sources                     #Whatever gets pressAndHoldHandler() called when a hold comes due
+        self.down=array.array("d",[0.0])*sources        #When it went down, 0 while it's up
+        self.generation=array.array("l",[0])*sources    #Bumped on every press, release and interruption, so a stale deadline is skipped
+        self.spent=array.array("B",[0])*sources         #Set once the press turned into a hold or a chord, so its release isn't a tap
+        self.lastRelease=array.array("d",[0.0])*sources
+        self.taps=array.array("B",[0])*sources
+        self.holdTime=array.array("d",[holdTime])*sources
+        self.multiTime=array.array("d",[multiTime])*sources   #Longest gap between releases that still counts towards a double or triple press
+        self.chords={}                                  #source -> chords it's part of
+        self.heap=[]                                    #(due,source,generation)
+        self.job=None
+        self.jobDue=0.0
+        self.presses=0
+        self.holds=0
+        self.multiPresses=0
+        self.chordsFired=0
+        self.stale=0
+
+    def setTiming(self,source,hold=None,multiPress=None):
+        if hold is not None: self.holdTime[source]=hold
+        if multiPress is not None: self.multiTime[source]=multiPress
+
+    def addChord(self,sources,handler,event):
+        chord=Chord(tuple(sources),handler,event)
+        for source in chord.sources: self.chords.setdefault(source,[]).append(chord)
+        return chord
+
+    def removeChord(self,sources):
+        sources=tuple(sources)
+        for source in sources:
+            remaining=[chord for chord in self.chords.get(source,()) if chord.sources!=sources]
+            if remaining: self.chords[source]=remaining
+            else: self.chords.pop(source,None)
+
+    def press(self,source,hold=True):     #hold is False when nobody wants to hear about a hold, so no deadline is queued
+        now=time.monotonic()
+        self.presses+=1
+        self.down[source]=now
+        self.spent[source]=0
+        self.generation[source]+=1
+        if hold:
+            due=now+self.holdTime[source]
+            heapq.heappush(self.heap,(due,source,self.generation[source]))
+            if self.job is None or due<self.jobDue: self.arm(due)
+        if source in self.chords: self.checkChords(source)
+
+    def release(self,source):   #How many taps in a row this release completes: 1, 2 for a double press, 3 for a triple; 0 after a hold, a chord, or with no press
+        now=time.monotonic()
+        self.generation[source]+=1
+        if not self.down[source]: return 0
+        self.down[source]=0.0
+        if self.spent[source]:
+            self.taps[source]=0
+            return 0
+        if now-self.lastRelease[source]<self.multiTime[source]: taps=self.taps[source]+1
+        else: taps=1
+        self.lastRelease[source]=now
+        self.taps[source]=0 if taps>=MAX_TAPS else taps
+        if taps>1: self.multiPresses+=1
+        return taps
+
+    def interrupt(self,source):     #Something else happened while it was held, like the knob being turned: no hold this time
+        self.generation[source]+=1
+
+    def checkChords(self,source):
+        down=self.down
+        for chord in self.chords[source]:
+            if all([down[member] for member in chord.sources]):
+                for member in chord.sources:
+                    self.spent[member]=1
+                    self.generation[member]+=1      #None of the members goes on to a hold of its own
+                self.chordsFired+=1
+                chord.fired+=1
+                chord.handler(chord.event)
+
+    def arm(self,due):
+        if self.job is not None: self.job.cancel()
+        self.jobDue=due
+        self.job=self.scheduler.after(max(due-time.monotonic(),0),self.run)
+
+    def run(self):      #Fires every hold that has come due, then waits for the next deadline
+        self.job=None
+        heap=self.heap
+        now=time.monotonic()
+        while heap and heap[0][0]<=now:
+            (due,source,generation)=heapq.heappop(heap)
+            if generation!=self.generation[source] or not self.down[source]:
+                self.stale+=1
+                continue
+            self.spent[source]=1
+            self.holds+=1
+            self.targets[source].pressAndHoldHandler()
+        if heap: self.arm(heap[0][0])
+
+    def stats(self):
+        retval={}
+        retval["presses"]=self.presses
+        retval["holds"]=self.holds
+        retval["multiPresses"]=self.multiPresses
+        retval["chords"]=self.chordsFired
+        retval["pending"]=len(self.heap)
+        retval["stale"]=self.stale
+        return retval
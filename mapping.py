@@ -0,0 +1,165 @@
+import functools
+import json
+import logging
+import os
+from acceleration import Accelerator,Curve
+from coalescer import Coalescer
+try:
+    import tomllib          #Python 3.11+; older Pythons can still use JSON profiles
+except ImportError:
+    tomllib=None
+
+RELOAD_PERIOD=1.0       #Seconds between checks of the profile's modification time
+FADER_FULL_SCALE=16256  #Raw fader level that Eos sees as 100%
+
+log=logging.getLogger("mapping")
+
+def loadProfile(path):
+    if path.endswith(".toml"):
+        if tomllib is None: raise ValueError("TOML profiles need Python 3.11 or later: {}".format(path))
+        with open(path,"rb") as f: return tomllib.load(f)
+    with open(path) as f: return json.load(f)
+
+class CompiledProfile(object):     #A profile flattened into lookup tables, so an event costs one index and no string formatting
+    def __init__(self,profile,mapper,channels):
+        pages=profile["encoderPages"]
+        curves={name:Curve(**spec) for (name,spec) in profile.get("curves",{}).items()}
+        default=Curve(**profile.get("defaultCurve",{}))
+        self.encoders=max([len(page["encoders"]) for page in pages])
+        self.pageNames=[page["name"] for page in pages]
+        self.labels=[]
+        self.wheels=[None]*(len(pages)*self.encoders)   #page*encoders+channel -> (OSC address,curve)
+        for p in range(len(pages)):
+            parameters=pages[p]["encoders"]
+            self.labels.append(parameters+[""]*(self.encoders-len(parameters)))
+            for ch in range(len(parameters)):
+                if parameters[ch]: self.wheels[p*self.encoders+ch]=("/eos/wheel/{}".format(parameters[ch]),curves.get(parameters[ch],default))
+        faders=profile.get("faders",{})
+        self.firstFader=faders.get("first",1)
+        self.faderAddresses=["/eos/fader/1/{}".format(self.firstFader+i) for i in range(channels)]
+        self.faderPages=faders.get("pages",7)
+        self.faderMaxRate=faders.get("maxRate",60)
+        self.faderIndicator=faders.get("indicator")     #Channel whose VU meter shows the fader page, or None
+        self.buttons={}     #Event name -> per-channel list of callables, None where the button isn't mapped
+        for spec in profile.get("buttons",[]):
+            table=self.buttons.setdefault(spec["event"],[None]*channels)
+            for ch in spec.get("channels",range(channels)):
+                table[ch]=self.compileAction(spec,ch,mapper)
+
+    def compileAction(self,spec,channel,mapper):
+        action=spec["action"]
+        if action=="encoderPage": return functools.partial(mapper.setEncoderPage,spec.get("page",channel))
+        if action=="faderPage": return functools.partial(mapper.setFaderPage,spec["page"])
+        if action=="faderPageNext": return mapper.nextFaderPage
+        if action=="faderPageReset": return functools.partial(mapper.setFaderPage,0)
+        raise ValueError("Unknown action {} for {}".format(action,spec["event"]))
+
+class Mapper(object):      #Drives Eos from the surface through a compiled profile; reloading swaps tables between events, never during one
+    def __init__(self,xt,console,path,watch=True):
+        self.xt=xt
+        self.console=console
+        self.path=path
+        self.encoderPage=0
+        self.faderPage=0
+        self.mtime=None
+        self.buttonEvents=set()
+        self.reloads=0
+        self.compiled=self.compile()
+        self.wheels=Accelerator(xt.scheduler,self.sendWheel)
+        self.toEos=Coalescer(xt.scheduler,self.sendEosFader,self.compiled.faderMaxRate)
+        latency=xt.metrics.histogram("oscToSetFader") if xt.metrics.enabled else None
+        self.toXTouch=Coalescer(xt.scheduler,self.sendXTouchFader,self.compiled.faderMaxRate,latency=latency)
+        xt.metrics.gauge("faders",self.faderStats)
+        xt.metrics.gauge("wheels",self.wheels.stats)
+        xt.bind("FaderLevel",self.xtFaderLevel)
+        console.bindHandler("FaderLevel",self.eosFaderLevel)
+        self.install()
+        self.watcher=xt.scheduler.every(RELOAD_PERIOD,self.checkReload) if watch else None
+
+    def compile(self):
+        self.mtime=os.path.getmtime(self.path)     #Even if it fails to load, so a broken file is only tried again once it's saved again
+        return CompiledProfile(loadProfile(self.path),self,len(self.xt.channel))
+
+    def install(self):      #Binds whatever the compiled profile needs and shows its labels; runs on the scheduler thread after a reload
+        compiled=self.compiled
+        encoders=list(range(min(compiled.encoders,len(self.xt.channel))))
+        self.xt.unbind("KnobIncrement")
+        self.xt.unbind("KnobDecrement")
+        self.xt.bind("KnobIncrement",self.knobIncrement,channels=encoders)
+        self.xt.bind("KnobDecrement",self.knobDecrement,channels=encoders)
+        for event in self.buttonEvents-set(compiled.buttons): self.xt.unbind(event)
+        for event in compiled.buttons:
+            table=compiled.buttons[event]
+            self.xt.bind(event,functools.partial(self.button,event),channels=[ch for ch in range(len(table)) if table[ch] is not None])
+        self.buttonEvents=set(compiled.buttons)
+        self.toEos.setMaxRate(compiled.faderMaxRate)
+        self.toXTouch.setMaxRate(compiled.faderMaxRate)
+        self.xt.setTexts(1,compiled.pageNames[:compiled.encoders])
+        self.setEncoderPage(min(self.encoderPage,len(compiled.pageNames)-1))
+        self.setFaderPage(self.faderPage%compiled.faderPages)
+
+    def checkReload(self):
+        try:
+            if os.path.getmtime(self.path)!=self.mtime: self.reload()
+        except OSError as error:    #Mid-save, or moved away: keep the profile we have
+            log.warning("Can't read profile %s: %s",self.path,error)
+
+    def reload(self):
+        try:
+            compiled=self.compile()
+        except Exception as error:
+            log.error("Profile %s not loaded, keeping the previous one: %s",self.path,error)
+            return
+        self.compiled=compiled      #One assignment: every event sees either the old tables or the new ones
+        self.reloads+=1
+        self.install()
+        log.info("Profile %s reloaded",self.path)
+
+    def setEncoderPage(self,page):     #The new page takes effect for the next event, and its labels go out in one flush
+        compiled=self.compiled
+        if page>=len(compiled.labels): return
+        self.encoderPage=page
+        self.xt.setTexts(0,compiled.labels[page])
+
+    def setFaderPage(self,page):
+        self.faderPage=page
+        if self.compiled.faderIndicator is not None: self.xt.channel[self.compiled.faderIndicator].vuBar.set((page*2)+1)
+        self.console.setFaderPage(page+1)
+
+    def nextFaderPage(self):
+        self.setFaderPage((self.faderPage+1)%self.compiled.faderPages)
+
+    def button(self,event,arg):
+        table=self.compiled.buttons.get(event)
+        if table is not None and table[arg["channel"]] is not None: table[arg["channel"]]()
+
+    def knobIncrement(self,arg):
+        self.rotate(arg,arg["magnitude"])
+
+    def knobDecrement(self,arg):
+        self.rotate(arg,-arg["magnitude"])
+
+    def rotate(self,arg,detents):
+        compiled=self.compiled
+        wheel=compiled.wheels[self.encoderPage*compiled.encoders+arg["channel"]]
+        if wheel is not None: self.wheels.rotate(wheel[0],detents,arg["velocity"],wheel[1])
+
+    def sendWheel(self,address,ticks):
+        self.console.send(address,float(ticks))
+
+    def xtFaderLevel(self,arg):
+        self.toEos.put(arg["fader"],arg["level"])
+
+    def sendEosFader(self,fader,level):
+        addresses=self.compiled.faderAddresses
+        if fader<len(addresses): self.console.send(addresses[fader],min(level,FADER_FULL_SCALE)/FADER_FULL_SCALE)
+
+    def eosFaderLevel(self,page,fader,level):
+        fader-=self.compiled.firstFader
+        if 0<=fader<len(self.xt.channel): self.toXTouch.put(fader,level)
+
+    def sendXTouchFader(self,fader,level):
+        self.xt.setFader(fader,round(level*(FADER_FULL_SCALE/100)))
+
+    def faderStats(self):
+        return {"toEos":self.toEos.stats(),"toXTouch":self.toXTouch.stats()}
@@ -0,0 +1,84 @@
+import threading
+import time
+
+METER_MAX=13            #Highest level; 0xe and 0xf on the wire set and clear the clip LED instead
+METER_REFRESH=0.05      #Seconds between refresh passes while any meter is lit
+METER_KEEPALIVE=0.25    #The surface lets a lit meter fall on its own, so an unchanged level is resent this often
+METER_PEAK_HOLD=0.5     #Seconds a fed peak is held before it starts to fall
+METER_DECAY=20.0        #Levels per second a fed meter falls once the hold is over
+
+class MeterBank(object):    #Every meter on the surface in flat arrays, refreshed together in one pass per interval
+    def __init__(self,scheduler,surfaces,interval=METER_REFRESH,keepalive=METER_KEEPALIVE,peakHold=METER_PEAK_HOLD,decay=METER_DECAY):
+        count=8*len(surfaces)
+        self.scheduler=scheduler
+        self.surfaces=surfaces
+        self.interval=interval
+        self.keepalive=keepalive
+        self.peakHold=peakHold
+        self.decayStep=decay*interval
+        self.lock=threading.Lock()
+        self.static=[0]*count       #Levels from set(), shown until changed
+        self.incoming=[0]*count     #Highest level fed since the last pass, so short peaks between passes aren't lost
+        self.peak=[0.0]*count       #Fed level as currently displayed, after hold and decay
+        self.peakTime=[0.0]*count
+        self.sent=[0]*count
+        self.sentTime=[0.0]*count
+        self.job=None
+        self.updates=0
+        self.refreshes=0
+
+    def set(self,meter,level):      #A level that stays up until it's changed, like VuBar.set
+        with self.lock:
+            self.updates+=1
+            self.static[meter]=max(0,min(METER_MAX,int(level)))
+            self.wake()
+
+    def feed(self,meter,level):     #One sample of a level stream, e.g. from Eos; can be called far faster than the meters refresh
+        with self.lock:
+            self.updates+=1
+            level=max(0,min(METER_MAX,int(level)))
+            if level>self.incoming[meter]: self.incoming[meter]=level
+            self.wake()
+
+    def wake(self):         #Caller holds the lock
+        if self.job is None: self.job=self.scheduler.every(self.interval,self.refresh)
+
+    def refresh(self):
+        now=time.monotonic()
+        changed=[]
+        lit=False
+        with self.lock:
+            static=self.static
+            incoming=self.incoming
+            peak=self.peak
+            sent=self.sent
+            for i in range(len(static)):
+                level=incoming[i]
+                if level>=peak[i]:
+                    peak[i]=level
+                    self.peakTime[i]=now
+                elif now-self.peakTime[i]>self.peakHold:
+                    peak[i]=max(level,peak[i]-self.decayStep)
+                incoming[i]=0
+                shown=max(static[i],int(peak[i]+.5))
+                if shown!=sent[i]:
+                    changed.append((i,shown,False))
+                elif shown and now-self.sentTime[i]>=self.keepalive:
+                    changed.append((i,shown,True))
+                if shown or peak[i]: lit=True
+            for (i,shown,refresh) in changed:
+                sent[i]=shown
+                self.sentTime[i]=now
+            if not lit:     #Everything is dark: stop ticking until the next set() or feed()
+                self.job.cancel()
+                self.job=None
+        for (i,shown,refresh) in changed:
+            self.surfaces[i//8].setMeter(i%8,shown,refresh)
+        self.refreshes+=len(changed)
+
+    def stats(self):
+        retval={}
+        retval["updates"]=self.updates
+        retval["refreshes"]=self.refreshes
+        retval["lit"]=sum([1 for level in self.sent if level])
+        return retval
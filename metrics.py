@@ -0,0 +1,126 @@
+import http.server
+import json
+import threading
+
+SUB_BUCKET_BITS=4
+SUB_BUCKETS=1<<SUB_BUCKET_BITS
+
+class Histogram(object):        #Log-linear (HDR style) histogram of non-negative integer values, ~6% relative precision
+    def __init__(self,unit="us"):
+        self.unit=unit
+        self.counts=[0]*(SUB_BUCKETS*8)
+        self.count=0
+        self.total=0
+        self.min=None
+        self.max=0
+
+    def bucketIndex(self,value):
+        if value<SUB_BUCKETS: return value
+        shift=value.bit_length()-SUB_BUCKET_BITS-1
+        return (shift+1)*SUB_BUCKETS+(value>>shift)-SUB_BUCKETS
+
+    def bucketValue(self,index):    #Upper bound of the values that land in this bucket
+        if index<SUB_BUCKETS: return index
+        shift=index//SUB_BUCKETS-1
+        return (((index%SUB_BUCKETS)+SUB_BUCKETS+1)<<shift)-1
+
+    def record(self,value):
+        value=int(value)
+        if value<0: value=0
+        i=self.bucketIndex(value)
+        if i>=len(self.counts): self.counts.extend([0]*(i+1-len(self.counts)))
+        self.counts[i]+=1
+        self.count+=1
+        self.total+=value
+        if self.min is None or value<self.min: self.min=value
+        if value>self.max: self.max=value
+
+    def percentile(self,p):
+        if self.count==0: return 0
+        target=self.count*p/100.0
+        seen=0
+        for i in range(len(self.counts)):
+            seen+=self.counts[i]
+            if seen>=target: return min(self.bucketValue(i),self.max)
+        return self.max
+
+    def reset(self):
+        self.counts=[0]*(SUB_BUCKETS*8)
+        self.count=0
+        self.total=0
+        self.min=None
+        self.max=0
+
+    def snapshot(self):
+        retval={}
+        retval["unit"]=self.unit
+        retval["count"]=self.count
+        retval["min"]=self.min if self.min is not None else 0
+        retval["max"]=self.max
+        retval["mean"]=self.total/self.count if self.count else 0.0
+        retval["p50"]=self.percentile(50)
+        retval["p90"]=self.percentile(90)
+        retval["p99"]=self.percentile(99)
+        return retval
+
+class Metrics(object):      #Counters, histograms and gauges for one rig; with enabled False the hot paths skip recording altogether
+    def __init__(self,enabled=False):
+        self.enabled=enabled
+        self.counters={}
+        self.histograms={}
+        self.gauges={}          #name -> callable read only when a snapshot is taken, e.g. queue depths and existing stats() methods
+
+    def histogram(self,name,unit="us"):
+        histogram=self.histograms.get(name)
+        if histogram is None: histogram=self.histograms[name]=Histogram(unit)
+        return histogram
+
+    def count(self,name,n=1):
+        if self.enabled: self.counters[name]=self.counters.get(name,0)+n
+
+    def gauge(self,name,read):
+        self.gauges[name]=read
+
+    def reset(self):
+        for name in self.counters: self.counters[name]=0
+        for histogram in self.histograms.values(): histogram.reset()
+
+    def snapshot(self):
+        retval={}
+        retval["enabled"]=self.enabled
+        retval["counters"]=dict(self.counters)
+        retval["histograms"]={name:self.histograms[name].snapshot() for name in self.histograms}
+        retval["gauges"]={name:self.gauges[name]() for name in self.gauges}
+        return retval
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0]!="/metrics":
+            self.send_error(404)
+            return
+        body=json.dumps(self.server.metrics.snapshot(),indent=1).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):     #Polling the endpoint shouldn't spam the console
+        pass
+
+class MetricsServer(object):    #GET http://host:port/metrics returns Metrics.snapshot() as JSON; local only unless told otherwise
+    def __init__(self,metrics,port=9100,host="127.0.0.1"):
+        self.server=http.server.ThreadingHTTPServer((host,port),MetricsHandler)
+        self.server.daemon_threads=True
+        self.server.metrics=metrics
+        self.thread=None
+
+    def start(self):
+        if self.thread is not None: return
+        self.thread=threading.Thread(target=self.server.serve_forever,name="Metrics server",daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread=None
@@ -0,0 +1,187 @@
+import collections
+import json
+import os
+import time
+
+class PygameBackend(object):        #PortMidi through pygame, what XTouch uses unless told otherwise
+    def __init__(self):
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT","1")
+        import pygame.midi          #Only paid for when the real hardware is used; the replay backends never touch pygame
+        self.midi=pygame.midi
+        self.midi.init()
+        self.info=None
+
+    def devices(self):      #(interface,name,input,output,opened) for every port, in PortMidi's order; enumerated once until rescan()
+        if self.info is None: self.info=[self.midi.get_device_info(i) for i in range(self.midi.get_count())]
+        return self.info
+
+    def rescan(self):       #PortMidi only sees ports that come and go across a restart, which also closes every port still open
+        self.midi.quit()
+        self.midi.init()
+        self.info=None
+
+    def openInput(self,deviceId):
+        return self.midi.Input(deviceId)
+
+    def openOutput(self,deviceId):
+        return self.midi.Output(deviceId)
+
+    def time(self):         #Milliseconds, the clock PortMidi stamps incoming events with
+        return self.midi.time()
+
+class ReplayBackend(object):        #Pretends to be one extender per capture: inputs replay the captures, outputs record what they're sent
+    def __init__(self,captures,name="X-Touch-Ext"):
+        self.start=time.monotonic()
+        self.name=name.encode("utf8")
+        self.inputs=[ReplayInput(capture,self.time) for capture in captures]
+        self.outputs=[RecordingOutput(self.time) for capture in captures]
+        self.plugged=[True]*len(captures)
+        self.rescans=0
+
+    def devices(self):      #Port 2n is unit n's input, 2n+1 its output, for the units currently plugged in
+        info=[]
+        for unit in range(len(self.plugged)):
+            if not self.plugged[unit]: continue
+            info.append((b"replay",self.name,1,0,0))
+            info.append((b"replay",self.name,0,1,0))
+        return info
+
+    def units(self):
+        return [unit for unit in range(len(self.plugged)) if self.plugged[unit]]
+
+    def rescan(self):
+        self.rescans+=1
+
+    def unplug(self,unit):      #Its ports start failing like a pulled USB cable, and it drops out of devices()
+        self.plugged[unit]=False
+        self.inputs[unit].unplugged=True
+        self.outputs[unit].unplugged=True
+
+    def replug(self,unit):      #Comes back with fresh ports; whatever was still queued for the old input is lost
+        self.plugged[unit]=True
+        self.inputs[unit]=ReplayInput([],self.time)
+        output=RecordingOutput(self.time)
+        output.written=self.outputs[unit].written
+        self.outputs[unit]=output
+
+    def openInput(self,deviceId):
+        return self.inputs[self.units()[deviceId//2]]
+
+    def openOutput(self,deviceId):
+        return self.outputs[self.units()[deviceId//2]]
+
+    def time(self):
+        return int((time.monotonic()-self.start)*1000)
+
+    def due(self,timestamp):    #When an event stamped timestamp is released, on the time.monotonic() clock
+        return self.start+timestamp/1000.0
+
+class CapturingBackend(object):     #Wraps another backend and keeps every event its inputs deliver, for replaying later
+    def __init__(self,backend):
+        self.backend=backend
+        self.inputs=[]
+
+    def devices(self):
+        return self.backend.devices()
+
+    def openInput(self,deviceId):
+        midiIn=CapturingInput(self.backend.openInput(deviceId))
+        self.inputs.append(midiIn)
+        return midiIn
+
+    def openOutput(self,deviceId):
+        return self.backend.openOutput(deviceId)
+
+    def time(self):
+        return self.backend.time()
+
+    def rescan(self):
+        self.backend.rescan()
+
+    def captures(self):
+        return [midiIn.captured for midiIn in self.inputs]
+
+class ReplayInput(object):      #Hands out events once the clock reaches their timestamp; with no clock everything is due at once
+    def __init__(self,events,clock=None):
+        self.events=collections.deque(events)
+        self.clock=clock
+        self.unplugged=False
+
+    def feed(self,events):
+        self.events.extend(events)
+
+    def poll(self):
+        if self.unplugged: raise IOError("MIDI input unplugged")
+        if not self.events: return False
+        return self.clock is None or self.events[0][1]<=self.clock()
+
+    def read(self,count):
+        events=self.events
+        out=[]
+        if self.clock is None:
+            while events and len(out)<count: out.append(events.popleft())
+            return out
+        now=self.clock()
+        while events and len(out)<count and events[0][1]<=now: out.append(events.popleft())
+        return out
+
+    def close(self):
+        pass
+
+class CapturingInput(object):
+    def __init__(self,midiIn):
+        self.midiIn=midiIn
+        self.captured=[]
+
+    def poll(self):
+        return self.midiIn.poll()
+
+    def read(self,count):
+        events=self.midiIn.read(count)
+        self.captured.extend(events)
+        return events
+
+    def close(self):
+        self.midiIn.close()
+
+def wireLength(status):     #Program change and channel pressure carry one data byte, everything else we send carries two
+    if 0xc0<=status<0xe0: return 2
+    return 3
+
+class RecordingOutput(object):      #Counts what would have gone down the wire and, with keep, logs it with the time it was sent
+    def __init__(self,clock=None,keep=False):
+        self.clock=clock
+        self.keep=keep
+        self.log=[]
+        self.messages=0
+        self.written=0
+        self.unplugged=False
+
+    def record(self,msg):
+        if self.unplugged: raise IOError("MIDI output unplugged")
+        self.messages+=1
+        self.written+=len(msg)
+        if self.keep: self.log.append((self.clock() if self.clock else 0,msg))
+
+    def write_short(self,status,data1=0,data2=0):
+        self.record([status,data1,data2][:wireLength(status)])
+
+    def write(self,data):
+        for (msg,timestamp) in data:
+            self.record(msg[:wireLength(msg[0])])
+
+    def write_sys_ex(self,when,msg):
+        self.record(list(msg))
+
+    def close(self):
+        pass
+
+def saveCapture(path,events):   #One [[status,data1,data2,data3],timestamp] event per line, timestamps rebased to the first event
+    first=events[0][1] if events else 0
+    with open(path,"w") as f:
+        for (msg,timestamp) in events:
+            f.write(json.dumps([msg,timestamp-first])+"\n")
+
+def loadCapture(path,offset=0):
+    with open(path) as f:
+        return [[msg,timestamp+offset] for (msg,timestamp) in [json.loads(line) for line in f if line.strip()]]
@@ -0,0 +1,99 @@
+import asyncio
+import collections
+import threading
+import time
+
+READ_BATCH_SIZE=64
+READER_MIN_WAIT=0.0005
+READER_ACTIVE_WAIT=0.002    #Longest wait while the surface is in use, which bounds the latency a quiet spell adds to the next event
+READER_ACTIVE_WINDOW=0.5    #Seconds after the last event that still count as in use
+READER_MAX_WAIT=0.016       #Longest wait once the surface has gone idle, so an idle reader wakes about 60 times a second
+
+class MidiReader(object):     #One reader services every input port, each with its own queue
+    def __init__(self,midiIns,onReady,batchSize=READ_BATCH_SIZE,minWait=READER_MIN_WAIT,maxWait=READER_MAX_WAIT,onError=None,activeWait=READER_ACTIVE_WAIT,activeWindow=READER_ACTIVE_WINDOW):
+        if not isinstance(midiIns,list): midiIns=[midiIns]
+        self.midiIns=midiIns        #None for an input that has failed, until setInput() puts a new one in its place
+        self.onReady=onReady        #Called from the reader thread whenever new events have been queued
+        self.onError=onError        #Called as onError(index,error) from the reader thread when an input fails
+        self.lock=threading.Lock()
+        self.batchSize=batchSize
+        self.minWait=minWait
+        self.maxWait=maxWait
+        self.activeWait=activeWait
+        self.activeWindow=activeWindow
+        self.lastEvent=0.0
+        self.queues=[collections.deque() for midiIn in midiIns]   #append/popleft are atomic, so producer and consumer don't need a lock
+        self.queue=self.queues[0]
+        self.running=False
+        self.thread=None
+        self.batches=0
+        self.events=0
+
+    def start(self):
+        if self.thread is not None: return
+        self.running=True
+        self.thread=threading.Thread(target=self.run,name="XTouch MIDI reader",daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running=False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread=None
+
+    def readBatch(self):        #Moves whatever is waiting on the ports into their queues, returns the number of events read
+        count=0
+        failed=[]
+        with self.lock:
+            for i in range(len(self.midiIns)):
+                midiIn=self.midiIns[i]
+                if midiIn is None: continue
+                try:
+                    if not midiIn.poll(): continue
+                    events=midiIn.read(self.batchSize)
+                except Exception as error:      #Unplugged, most likely; stop polling it and let the owner reconnect
+                    self.midiIns[i]=None
+                    failed.append((i,error))
+                    continue
+                self.queues[i].extend(events)
+                self.batches+=1
+                count+=len(events)
+        self.events+=count
+        for (i,error) in failed:
+            if self.onError is not None: self.onError(i,error)
+        return count
+
+    def setInput(self,index,midiIn):    #Swaps a port in or out (None) between reads
+        with self.lock:
+            self.midiIns[index]=midiIn
+
+    def queued(self):
+        return sum([len(queue) for queue in self.queues])
+
+    def nextWait(self,wait):    #PortMidi can't block on input, so back off: quickly to activeWait, then to maxWait once the surface has been idle a while
+        if time.monotonic()-self.lastEvent<self.activeWindow: return min(wait*2,self.activeWait)
+        return min(wait*2,self.maxWait)
+
+    def run(self):
+        wait=self.minWait
+        while self.running:
+            if self.readBatch():
+                while self.readBatch(): pass    #Drain a burst completely before handing off
+                self.onReady()
+                self.lastEvent=time.monotonic()
+                wait=self.minWait
+            else:
+                time.sleep(wait)
+                wait=self.nextWait(wait)
+
+    async def runAsync(self):   #The same loop as run(), as an asyncio task instead of a thread
+        wait=self.minWait
+        while True:
+            if self.readBatch():
+                while self.readBatch(): pass
+                self.onReady()
+                self.lastEvent=time.monotonic()
+                wait=self.minWait
+            else:
+                await asyncio.sleep(wait)
+                wait=self.nextWait(wait)
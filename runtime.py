@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+async def driveScheduler(scheduler):   #Runs the scheduler's jobs on the loop instead of on the scheduler thread
+    loop=asyncio.get_running_loop()
+    ready=asyncio.Event()
+    scheduler.wakeup=lambda: loop.call_soon_threadsafe(ready.set)
+    try:
+        while True:
+            ready.clear()
+            nextDue=scheduler.runDue()
+            if nextDue is None: timeout=None
+            else: timeout=max(nextDue-time.monotonic(),0)
+            try:
+                await asyncio.wait_for(ready.wait(),timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        scheduler.wakeup=None
+
+async def serve(xt,e):
+    transport=await e.serveAsync()
+    try:
+        await asyncio.gather(driveScheduler(xt.scheduler),xt.midiReader.runAsync())
+    finally:
+        transport.close()
+
+def run(xt,e):      #Blocking, like eos.start(); build the XTouch with autoStart=False
+    asyncio.run(serve(xt,e))
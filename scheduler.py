@@ -0,0 +1,141 @@
+import heapq
+import logging
+import threading
+import time
+
+log=logging.getLogger("scheduler")
+
+class Job(object):
+    def __init__(self,scheduler,callback,args,due,period):
+        self.scheduler=scheduler
+        self.callback=callback
+        self.args=args
+        self.due=due
+        self.period=period          #None for one-shot jobs
+        self.cancelled=False
+        self.runs=0
+        self.skipped=0              #Periodic ticks dropped because we fell more than a whole period behind
+        self.maxLateness=0.0
+        self.totalLateness=0.0
+
+    def cancel(self):
+        self.cancelled=True
+
+    def stats(self):
+        retval={}
+        retval["runs"]=self.runs
+        retval["skipped"]=self.skipped
+        retval["maxLateness"]=self.maxLateness
+        retval["meanLateness"]=self.totalLateness/self.runs if self.runs else 0.0
+        return retval
+
+class Scheduler(object):
+    def __init__(self,name="XTouch scheduler"):
+        self.name=name
+        self.heap=[]
+        self.seq=0                  #Tie-breaker so jobs due at the same instant run in the order they were added
+        self.cv=threading.Condition()
+        self.thread=None
+        self.running=False
+        self.wakeup=None            #Set by whatever drives runDue() when there's no scheduler thread, e.g. an asyncio loop
+        self.ticks=0
+        self.overruns=0
+        self.skipped=0
+        self.maxLateness=0.0
+        self.totalLateness=0.0
+        self.lateness=None          #Optional metrics Histogram of every job's lateness in microseconds
+
+    def start(self):
+        if self.thread is not None: return
+        self.running=True
+        self.thread=threading.Thread(target=self.run,name=self.name,daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cv:
+            self.running=False
+            self.cv.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread=None
+
+    def schedule(self,due,callback,args,period):
+        with self.cv:
+            job=Job(self,callback,args,due,period)
+            self.seq+=1
+            heapq.heappush(self.heap,(due,self.seq,job))
+            if self.heap[0][2] is job:  #Only wake the driver if this job is now the next one due
+                self.cv.notify()
+                if self.wakeup is not None: self.wakeup()
+        return job
+
+    def every(self,period,callback,*args):
+        return self.schedule(time.monotonic()+period,callback,args,period)
+
+    def after(self,delay,callback,*args):
+        return self.schedule(time.monotonic()+delay,callback,args,None)
+
+    def callSoon(self,callback,*args):
+        return self.schedule(time.monotonic(),callback,args,None)
+
+    def nextDue(self):
+        with self.cv:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+            if self.heap: return self.heap[0][0]
+            return None
+
+    def runDue(self):               #Runs every job that is due now, returns the time the next one falls due (or None)
+        while True:
+            with self.cv:
+                if not self.heap: return None
+                (due,seq,job)=self.heap[0]
+                if job.cancelled:
+                    heapq.heappop(self.heap)
+                    continue
+                now=time.monotonic()
+                if due>now: return due
+                heapq.heappop(self.heap)
+                if job.period is not None:
+                    nextDue=due+job.period
+                    if nextDue<=now:                    #Overrun: skip the missed ticks rather than running them back to back
+                        missed=int((now-due)/job.period)
+                        job.skipped+=missed
+                        self.skipped+=missed
+                        self.overruns+=1
+                        nextDue=due+(missed+1)*job.period
+                    self.seq+=1
+                    heapq.heappush(self.heap,(nextDue,self.seq,job))
+            self.runJob(job,now-due)
+
+    def runJob(self,job,lateness):
+        job.runs+=1
+        job.totalLateness+=lateness
+        if lateness>job.maxLateness: job.maxLateness=lateness
+        self.ticks+=1
+        self.totalLateness+=lateness
+        if lateness>self.maxLateness: self.maxLateness=lateness
+        if self.lateness is not None: self.lateness.record(lateness*1000000)
+        try:
+            job.callback(*job.args)
+        except Exception:
+            log.exception("Job %s failed",getattr(job.callback,"__qualname__",job.callback))   #A misbehaving handler mustn't take the whole surface down with it
+
+    def run(self):
+        while True:
+            self.runDue()
+            with self.cv:
+                if not self.running: return
+                if not self.heap: self.cv.wait()
+                else:
+                    delay=self.heap[0][0]-time.monotonic()
+                    if delay>0: self.cv.wait(delay)
+
+    def stats(self):
+        retval={}
+        retval["ticks"]=self.ticks
+        retval["overruns"]=self.overruns
+        retval["skipped"]=self.skipped
+        retval["maxLateness"]=self.maxLateness
+        retval["meanLateness"]=self.totalLateness/self.ticks if self.ticks else 0.0
+        return retval
@@ -0,0 +1,213 @@
+import threading
+import time
+
+LCD_SYSEX_HEADER=[0xf0,0x00,0x00,0x66,0x15,0x12]
+LCD_LINE_LENGTH=56      #8 channels of 7 characters per line
+LCD_SIZE=2*LCD_LINE_LENGTH
+LCD_FRAME_OVERHEAD=len(LCD_SYSEX_HEADER)+2     #Header, start offset and the closing 0xf7
+MIDI_WIRE_RATE=3125     #Bytes/sec a 31250 baud MIDI link carries, at 10 bits a byte
+MIDI_BURST=128          #Bytes that can go out at once after a quiet spell before pacing kicks in
+SHORT_PRIORITY={"fader":0,"led":1,"ring":2,"meter":3}   #Order short messages go out in when the wire is busy; faders never wait, text always comes last
+SHORT_LENGTH={"fader":3,"led":3,"ring":3,"meter":2}
+
+class SurfaceState(object):     #Shadow of everything we've told the surface to show; only cells that actually change go out on the wire
+    def __init__(self,midiOut,scheduler,onError=None,rate=MIDI_WIRE_RATE,burst=MIDI_BURST):
+        self.midiOut=midiOut        #None while the unit is disconnected: state keeps updating, nothing is sent
+        self.onError=onError        #Called as onError(error) when a write fails
+        self.scheduler=scheduler
+        self.rate=rate
+        self.burst=burst
+        self.credit=float(burst)    #Bytes we may send now; goes negative after a big frame, and flushing waits for it to climb back
+        self.creditTime=time.monotonic()
+        self.lock=threading.Lock()
+        self.text=bytearray(b" "*LCD_SIZE)      #What the LCD should show
+        self.sentText=bytearray(LCD_SIZE)       #What it does show, as far as we know; 0 is never printable, so zeroed cells always count as changed
+        self.rings=[0]*8
+        self.sentRings=[None]*8
+        self.leds=[0]*32
+        self.sentLeds=[None]*32
+        self.meters=[0]*8
+        self.sentMeters=[None]*8
+        self.faders=[0]*8                       #Raw 14-bit pitch bend values
+        self.sentFaders=[None]*8
+        self.textDirty=False
+        self.dirtyShort=set()                   #(kind,index) for rings, LEDs, meters and faders
+        self.flushPending=False
+        self.pacingJob=None         #The flush waiting for the wire to catch up, if any
+        self.messages=0
+        self.bytes=0
+        self.suppressed=0
+        self.deferred=0             #Flushes that left something for later because the wire was busy
+
+    def setText(self,channel,line,text):
+        self.setTexts(line,[text],channel)
+
+    def setTexts(self,line,texts,firstChannel=0):    #One 7-character field per channel, starting at firstChannel
+        offset=line*LCD_LINE_LENGTH+firstChannel*7
+        cells=b"".join([text[:7].ljust(7).encode("ascii","replace") for text in texts])
+        end=offset+len(cells)
+        with self.lock:
+            if self.text[offset:end]==cells and self.sentText[offset:end]==cells:
+                self.suppressed+=1
+                return
+            self.text[offset:end]=cells
+            self.textDirty=True
+            self.requestFlush()
+
+    def repaint(self,heldFaders=()):      #Forget what we think is showing and send everything again, except motor moves for heldFaders
+        with self.lock:
+            self.sentText[:]=bytearray(LCD_SIZE)
+            self.sentRings=[None]*8
+            self.sentLeds=[None]*32
+            self.sentMeters=[None]*8
+            self.textDirty=True
+            for i in range(8):
+                self.dirtyShort.add(("ring",i))
+                self.dirtyShort.add(("meter",i))
+                if i in heldFaders: continue
+                self.sentFaders[i]=None
+                self.dirtyShort.add(("fader",i))
+            for i in range(32): self.dirtyShort.add(("led",i))
+            self.requestFlush()
+
+    def resume(self):       #New ports for a unit that never lost its display: send only what changed while nothing could be written
+        with self.lock:
+            if self.dirtyShort or self.textDirty: self.requestFlush()
+
+    def textSpans(self):    #Smallest set of [start,end) runs covering every changed cell; caller holds the lock
+        spans=[]
+        text=self.text
+        sent=self.sentText
+        i=0
+        while i<LCD_SIZE:
+            if text[i]==sent[i]:
+                i+=1
+                continue
+            start=i
+            end=i+1
+            i+=1
+            while i<LCD_SIZE:
+                if text[i]!=sent[i]:
+                    end=i+1
+                elif i-end>=LCD_FRAME_OVERHEAD:     #Resending unchanged cells is cheaper than opening a new frame, up to a point
+                    break
+                i+=1
+            spans.append((start,end))
+            i=end
+        return spans
+
+    def setRing(self,channel,val):
+        self.setShort("ring",self.rings,self.sentRings,channel,val)
+
+    def setLed(self,led,on):
+        self.setShort("led",self.leds,self.sentLeds,led,0x7f if on else 0x00)
+
+    def setMeter(self,channel,level,refresh=False):     #The meters decay on their own, so a refresh resends an unchanged level
+        if refresh:
+            with self.lock:
+                self.meters[channel]=level
+                self.sentMeters[channel]=None
+                self.dirtyShort.add(("meter",channel))
+                self.requestFlush()
+        else: self.setShort("meter",self.meters,self.sentMeters,channel,level)
+
+    def setFader(self,fader,raw):
+        self.setShort("fader",self.faders,self.sentFaders,fader,raw)
+
+    def noteFader(self,fader,raw):      #The fader was moved by hand, so the motor is already where it's being told to go
+        with self.lock:
+            self.faders[fader]=raw
+            self.sentFaders[fader]=raw
+
+    def setShort(self,kind,wanted,sent,index,val):
+        with self.lock:
+            wanted[index]=val
+            if sent[index]==val:
+                self.dirtyShort.discard((kind,index))
+                self.suppressed+=1
+                return
+            self.dirtyShort.add((kind,index))
+            if kind=="fader" and self.pacingJob is not None:    #A motor move doesn't wait behind text: flush now and pace the rest from there
+                self.pacingJob.cancel()
+                self.pacingJob=None
+                self.flushPending=False
+            self.requestFlush()
+
+    def requestFlush(self):     #Caller holds the lock
+        if not self.flushPending:
+            self.flushPending=True
+            self.scheduler.callSoon(self.flush)
+
+    def flush(self):    #The only place anything is written to the unit, always on the scheduler thread, highest priority first and paced to the wire
+        with self.lock:
+            self.flushPending=False
+            self.pacingJob=None
+            if self.midiOut is None: return     #Leave it all dirty: resume() or repaint() sends it once there are ports again
+            now=time.monotonic()
+            credit=min(self.burst,self.credit+(now-self.creditTime)*self.rate)
+            self.creditTime=now
+            written=0
+            shortMessages=[]
+            for (kind,index) in sorted(self.dirtyShort,key=lambda item:SHORT_PRIORITY[item[0]]):
+                if credit<=0 and kind!="fader": break
+                credit-=SHORT_LENGTH[kind]
+                written+=SHORT_LENGTH[kind]
+                self.dirtyShort.discard((kind,index))
+                if kind=="fader":
+                    raw=self.faders[index]
+                    shortMessages.append([[0xe0+index,raw&0x7f,raw>>7],0])
+                    self.sentFaders[index]=raw
+                elif kind=="ring":
+                    shortMessages.append([[0xb0,0x30+index,self.rings[index]],0])
+                    self.sentRings[index]=self.rings[index]
+                elif kind=="led":
+                    shortMessages.append([[0x90,index,self.leds[index]],0])
+                    self.sentLeds[index]=self.leds[index]
+                else:
+                    shortMessages.append([[0xd0,16*index+self.meters[index],0x00],0])
+                    self.sentMeters[index]=self.meters[index]
+            sysex=[]
+            if self.textDirty:
+                self.textDirty=False
+                for (start,end) in self.textSpans():
+                    if credit<=0:
+                        self.textDirty=True
+                        break
+                    cells=self.text[start:end]
+                    sysex.append(LCD_SYSEX_HEADER+[start]+list(cells)+[0xf7])
+                    credit-=len(sysex[-1])
+                    written+=len(sysex[-1])
+                    self.sentText[start:end]=cells
+            self.credit=credit
+            if self.dirtyShort or self.textDirty:   #Whatever didn't fit waits until the wire has caught up, and is sent as it is by then
+                self.deferred+=1
+                self.flushPending=True
+                self.pacingJob=self.scheduler.after(max(-credit,1)/self.rate,self.flush)
+        midiOut=self.midiOut
+        if midiOut is None: return      #Lost while we were building the messages; the repaint on reconnect sends them
+        try:
+            if shortMessages:
+                midiOut.write(shortMessages)       #One PortMidi call for every short message this tick
+                self.messages+=len(shortMessages)
+            for msg in sysex:
+                midiOut.write_sys_ex(0,msg)
+                self.messages+=1
+            self.bytes+=written
+        except Exception as error:
+            self.midiOut=None
+            if self.onError is not None: self.onError(error)
+
+    def backlog(self):      #Bytes waiting for the wire
+        with self.lock:
+            pending=sum([SHORT_LENGTH[kind] for (kind,index) in self.dirtyShort])
+            if self.textDirty: pending+=sum([end-start+LCD_FRAME_OVERHEAD for (start,end) in self.textSpans()])
+            return pending
+
+    def stats(self):
+        retval={}
+        retval["messages"]=self.messages
+        retval["bytes"]=self.bytes
+        retval["suppressed"]=self.suppressed
+        retval["deferred"]=self.deferred
+        retval["backlog"]=self.backlog()
+        return retval
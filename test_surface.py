@@ -0,0 +1,97 @@
+import unittest
+from midibackend import RecordingOutput,ReplayBackend
+from scheduler import Scheduler
+from surface import LCD_LINE_LENGTH,LCD_SYSEX_HEADER,SurfaceState
+import XTouch
+
+PAGE_NAMES=["core","color1","color2","shutter","gobo","5","6","7"]
+LABELS=["level","pan","tilt","zoom","edge","iris","",""]
+
+def makeSurface():     #A surface writing to a recording output; nothing is flushed until the test calls flush()
+    out=RecordingOutput(keep=True)
+    return (SurfaceState(out,Scheduler(),burst=4096),out)
+
+def frames(out):        #(start offset,cells) for every LCD frame written
+    return [(msg[len(LCD_SYSEX_HEADER)],bytes(msg[len(LCD_SYSEX_HEADER)+1:-1])) for (timestamp,msg) in out.log if msg[:len(LCD_SYSEX_HEADER)]==LCD_SYSEX_HEADER]
+
+class ScribbleStripPackingTest(unittest.TestCase):
+    def paint(self):
+        (surface,out)=makeSurface()
+        surface.setTexts(1,PAGE_NAMES)
+        surface.setTexts(0,LABELS)
+        surface.flush()
+        out.log=[]
+        out.written=0
+        return (surface,out)
+
+    def testInitialPaintIsOneFrame(self):
+        (surface,out)=makeSurface()
+        surface.setTexts(1,PAGE_NAMES)
+        surface.setTexts(0,LABELS)
+        surface.flush()
+        self.assertEqual(out.written,120)      #Both lines, 112 cells, in one frame
+        self.assertEqual(len(frames(out)),1)
+        self.assertEqual(frames(out)[0][0],0)
+
+    def testNearbyChangesShareAFrame(self):
+        (surface,out)=self.paint()
+        surface.setTexts(0,["Level","Pan"])     #Cells 0 and 7: resending the six between is cheaper than a second frame
+        surface.flush()
+        self.assertEqual(frames(out),[(0,b"Level  P")])
+        self.assertEqual(out.written,16)
+
+    def testDistantChangesGetTheirOwnFrames(self):
+        (surface,out)=self.paint()
+        surface.setText(0,0,"Level")
+        surface.setText(5,0,"Iris")
+        surface.flush()
+        self.assertEqual(frames(out),[(0,b"L"),(35,b"I")])
+        self.assertEqual(out.written,18)
+
+    def testPageFlipSendsOnlyChangedCells(self):
+        (surface,out)=self.paint()
+        surface.setTexts(0,["level","red","green","blue","amber","white","hue","saturation"])
+        surface.flush()
+        spans=frames(out)
+        self.assertEqual(spans,[(7,b"red    green  blue   amber  white  hue    saturat")])
+        self.assertEqual(out.written,len(LCD_SYSEX_HEADER)+2+len(spans[0][1]))
+
+    def testSpanCrossesIntoTheSecondLine(self):
+        (surface,out)=self.paint()
+        surface.setText(7,0,"edge")       #The last cells of line 0 run straight on into line 1
+        surface.setText(0,1,"CORE")
+        surface.flush()
+        self.assertEqual(frames(out),[(LCD_LINE_LENGTH-7,b"edge   CORE")])
+        self.assertEqual(out.written,len(LCD_SYSEX_HEADER)+2+11)
+
+    def testUnchangedTextWritesNothing(self):
+        (surface,out)=self.paint()
+        surface.setTexts(0,LABELS)
+        surface.setText(3,1,"shutter")
+        surface.flush()
+        self.assertEqual(out.written,0)
+        self.assertEqual(surface.suppressed,2)
+
+class XTouchSetTextsTest(unittest.TestCase):
+    def testRunIsSplitAtUnitBoundaries(self):
+        xt=XTouch.XTouch(backend=ReplayBackend([[],[]]),autoStart=False)
+        for device in xt.devices: device.midiOut.keep=True
+        xt.setTexts(0,["ch%d"%ch for ch in range(4,12)],4)
+        for device in xt.devices: device.surface.flush()
+        self.assertEqual(frames(xt.devices[0].midiOut),[(0,b"                            ch4    ch5    ch6    ch7    "+b" "*56)])
+        self.assertEqual(frames(xt.devices[1].midiOut),[(0,b"ch8    ch9    ch10   ch11   "+b" "*84)])
+
+class XTouchFaderTest(unittest.TestCase):
+    def testFirstMotorMoveAlwaysGoesOut(self):     #Where a fader was left last session is unknown, so even a level near 0 moves it
+        xt=XTouch.XTouch(backend=ReplayBackend([[]]),autoStart=False)
+        xt.devices[0].midiOut.keep=True
+        xt.setFader(0,0)
+        xt.setFader(1,5)
+        xt.devices[0].surface.flush()
+        self.assertEqual(sorted([msg[0] for (timestamp,msg) in xt.devices[0].midiOut.log]),[0xe0,0xe1])
+        self.assertEqual(xt.controls.faderStats()["unchanged"],0)
+        xt.setFader(0,0)
+        self.assertEqual(xt.controls.faderStats()["unchanged"],1)
+
+if __name__=="__main__":
+    unittest.main()